@@ -8,6 +8,8 @@ from src.hyperparameters import hyperparams_svr
 from src.model_runner import ModelRunner
 from src.models import MySVR
 
+from concurrent.futures import ProcessPoolExecutor
+
 from sklearn.svm import SVR
 
 
@@ -29,9 +31,14 @@ if __name__ == "__main__":
     # print("Optimized hyperparameters:\n", hp_cfg)
     # print("Metrics:\n", metrics)
 
-    runner.shap(
-        model_type, hyperparams_svr.get_current_config(), pred_caller=pred_caller
-    )
+    with ProcessPoolExecutor() as executor:
+        runner.shap(
+            model_type,
+            hyperparams_svr.get_current_config(),
+            pred_caller=pred_caller,
+            executor=executor,
+            values_path="svr_shap_values.npz",
+        )
 
     """
     sklearn SVR result
@@ -0,0 +1,60 @@
+import time
+
+import numpy as np
+
+from src.models import DecisionTree, Model, MySVR, RandomForest
+
+BATCH_SIZES = [1, 16, 256, 4096, None]
+
+
+def make_dataset(n_rows: int, n_features: int = 16, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(n_rows, n_features))
+    y = (X[:, 0] + X[:, 1] * X[:, 2] > 0).astype(int)
+    return X, y
+
+
+def check_conformance(model: Model, X: np.ndarray, chunk_size: int = 7):
+    y_batch = model.predict(X)
+    y_chunked = model.predict(X, chunk_size=chunk_size)
+    y_rows = np.array([model.predict_one(x) for x in X])
+
+    assert y_batch.shape == (len(X),), y_batch.shape
+    assert np.allclose(y_batch, y_chunked), "chunked predict differs from batch"
+    assert np.allclose(y_batch, y_rows), "predict_one differs from batch"
+
+
+def benchmark_model(model: Model, X: np.ndarray, repeats: int = 3):
+    rows_per_second = {}
+    for batch_size in BATCH_SIZES:
+        best_time = np.inf
+        for _ in range(repeats):
+            start_time = time.perf_counter()
+            model.predict(X, chunk_size=batch_size)
+            best_time = min(best_time, time.perf_counter() - start_time)
+        rows_per_second[batch_size] = len(X) / best_time
+    return rows_per_second
+
+
+if __name__ == "__main__":
+    X_train, y_train = make_dataset(2000)
+    X_test, _ = make_dataset(20000, seed=1)
+
+    models = {
+        "DecisionTree": (DecisionTree(method="gini", max_depth=5), 2000),
+        "RandomForest": (
+            RandomForest(n_estimators=10, max_depth=5, max_features="sqrt"),
+            2000,
+        ),
+        # the QP solver is quadratic in python, keep its training set tiny
+        "MySVR": (MySVR(kernel="poly", degree=2, C=1.0, epsilon=1e-2), 30),
+    }
+
+    for name, (model, n_train) in models.items():
+        model.fit(X_train[:n_train], y_train[:n_train])
+        check_conformance(model, X_test[:200])
+
+        rows_per_second = benchmark_model(model, X_test)
+        print(f"===== {name} =====")
+        for batch_size, speed in rows_per_second.items():
+            print(f"batch={str(batch_size or 'full'):>6}: {speed:12.0f} rows/s")
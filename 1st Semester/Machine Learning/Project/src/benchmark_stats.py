@@ -0,0 +1,69 @@
+import time
+
+import numpy as np
+import pandas as pd
+
+from src.stats import StatisticalTests
+
+
+def make_frame(n_rows: int, n_continuous: int = 40, n_categorical: int = 10, seed=0):
+    rng = np.random.default_rng(seed)
+    latent = rng.normal(size=(n_rows, 1))
+    columns = {}
+    for i in range(n_continuous):
+        weight = rng.uniform(-1, 1)
+        columns[f"c{i}"] = np.exp(weight * latent[:, 0] + rng.normal(size=n_rows))
+    for i in range(n_categorical):
+        columns[f"k{i}"] = np.digitize(
+            latent[:, 0] + rng.normal(size=n_rows), [-1, 0, 1]
+        )
+    return pd.DataFrame(columns)
+
+
+def iterate_chunks(df: pd.DataFrame, chunksize: int):
+    return lambda: (
+        df.iloc[start : start + chunksize] for start in range(0, len(df), chunksize)
+    )
+
+
+def timed(action: callable):
+    start_time = time.perf_counter()
+    result = action()
+    return result, time.perf_counter() - start_time
+
+
+if __name__ == "__main__":
+    df = make_frame(500_000)
+    chunks = iterate_chunks(df, chunksize=50_000)
+
+    for method in ["pearson", "spearman"]:
+        exact, exact_time = timed(
+            lambda: StatisticalTests.correlation_matrix(df, method=method)
+        )
+        for sample_size in [1_000, 10_000, 100_000]:
+            approx, approx_time = timed(
+                lambda: StatisticalTests.streaming_correlation_matrix(
+                    chunks, method=method, sample_size=sample_size, seed=0
+                )
+            )
+            error = np.max(np.abs(exact.to_numpy() - approx.to_numpy()))
+            print(
+                f"{method:>8} m={sample_size:>7}: exact {exact_time:7.2f}s | "
+                f"streaming {approx_time:7.2f}s | max abs error {error:.2e}"
+            )
+            if method == "pearson":
+                break
+
+    exact, exact_time = timed(lambda: StatisticalTests.independence_matrix(df))
+    for sample_size in [1_000, 10_000, 100_000]:
+        approx, approx_time = timed(
+            lambda: StatisticalTests.sampled_independence_matrix(
+                chunks, sample_size=sample_size, seed=0
+            )
+        )
+        # compare the decisions at the 5% level, p-values depend on the sample size
+        agreement = np.mean((exact.to_numpy() < 0.05) == (approx.to_numpy() < 0.05))
+        print(
+            f"independence m={sample_size:>7}: exact {exact_time:7.2f}s | "
+            f"sampled {approx_time:7.2f}s | 5% decision agreement {agreement:.3f}"
+        )
@@ -1,27 +1,330 @@
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
 import pandas as pd
 
+from .preprocessor import (
+    DateAndTimePipeline,
+    DateAndTimePreprocessor,
+    make_occupancy_log,
+)
+
 
 class OccupancyEstimationDataloader:
     _TARGET_COLUMN = "Room_Occupancy_Count"
+    _CACHE_FORMAT_VERSION = 1
+
+    def __init__(
+        self,
+        path: str,
+        transform: callable = lambda x: x,
+        cache_dir: str | None = None,
+    ):
+        self.output_column = self._TARGET_COLUMN
+        self._dataframe = None
+        self._arrays = None
+        self._cache_meta = None
+
+        if cache_dir is None:
+            self._set_dataframe(transform(pd.read_csv(path)))
+        else:
+            self._load_cached(path, transform, cache_dir)
 
-    def __init__(self, path: str, transform: callable = lambda x: x):
-        self.dataframe = transform(pd.read_csv(path))
+    def _set_dataframe(self, dataframe: pd.DataFrame):
+        self._dataframe = dataframe
         self.input_columns = [
-            column for column in self.dataframe.columns if column != self._TARGET_COLUMN
+            column for column in dataframe.columns if column != self._TARGET_COLUMN
         ]
-        self.output_column = self._TARGET_COLUMN        
 
-    def __getitem__(self, idx: int):
+    @property
+    def dataframe(self) -> pd.DataFrame:
+        if self._dataframe is None:
+            # rebuilt on demand only, cached loads work on the mapped arrays
+            X, y = self._arrays
+            dataframe = pd.DataFrame(np.asarray(X), columns=self.input_columns)
+            dataframe[self.output_column] = np.asarray(y)
+            self._dataframe = dataframe[self._cache_meta["columns"]].astype(
+                self._cache_meta["dtypes"]
+            )
+        return self._dataframe
+
+    @classmethod
+    def _cache_key(cls, path: str, transform: callable) -> str:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+
+        # transforms are identified by their qualified name and VERSION,
+        # which has to be bumped whenever their output changes
+        owner = getattr(transform, "__self__", transform)
+        transform_name = getattr(transform, "__qualname__", type(transform).__name__)
+        digest.update(f"{transform.__module__}.{transform_name}".encode())
+        digest.update(str(getattr(owner, "VERSION", None)).encode())
+        digest.update(str(cls._CACHE_FORMAT_VERSION).encode())
+        return digest.hexdigest()[:32]
+
+    @classmethod
+    def _atomic_save(cls, path: str, write: callable):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            write(f)
+        os.replace(tmp_path, path)
+
+    def _load_cached(self, path: str, transform: callable, cache_dir: str):
+        key = self._cache_key(path, transform)
+        x_path, y_path, meta_path = (
+            os.path.join(cache_dir, f"{key}_{name}")
+            for name in ("X.npy", "y.npy", "meta.json")
+        )
+
+        if not os.path.exists(meta_path):
+            self._set_dataframe(transform(pd.read_csv(path)))
+            X, y = self.to_numpy()
+            meta = {
+                "columns": list(self._dataframe.columns),
+                "input_columns": self.input_columns,
+                "dtypes": {
+                    column: str(dtype)
+                    for column, dtype in self._dataframe.dtypes.items()
+                },
+            }
+
+            os.makedirs(cache_dir, exist_ok=True)
+            self._atomic_save(x_path, lambda f: np.save(f, X))
+            self._atomic_save(y_path, lambda f: np.save(f, y))
+            # the metadata is written last and marks the cache entry as complete
+            self._atomic_save(meta_path, lambda f: f.write(json.dumps(meta).encode()))
+
+        with open(meta_path, "r") as f:
+            self._cache_meta = json.load(f)
+        self.input_columns = self._cache_meta["input_columns"]
+        self._arrays = (
+            np.load(x_path, mmap_mode="r"),
+            np.load(y_path, mmap_mode="r"),
+        )
+
+    def to_numpy(self, dtype: type = np.float64) -> tuple[np.ndarray, np.ndarray]:
+        if self._arrays is not None:
+            X, y = self._arrays
+            return (X if X.dtype == dtype else X.astype(dtype)), y
+
+        X = np.ascontiguousarray(
+            self.dataframe[self.input_columns].to_numpy(dtype=dtype)
+        )
+        y = self.dataframe[self.output_column].to_numpy(dtype=np.int64)
+        return X, y
+
+    def _get_batch(self, idx: slice | list | np.ndarray):
+        if self._arrays is None:
+            self._arrays = self.to_numpy()
+        X, y = self._arrays
+        return X[idx], y[idx]
+
+    def __getitem__(self, idx: int | slice | list | np.ndarray):
+        if not isinstance(idx, (int, np.integer)):
+            return self._get_batch(idx)
+
         row = self.dataframe.iloc[idx]
 
         row_input = row[self.input_columns].to_dict()
         row_output = row[self.output_column]
 
         return row_input, row_output
-        
-    def __iter__(self):        
-        for i in range(self.dataframe.shape[0]):
+
+    def __iter__(self):
+        for i in range(len(self)):
             yield self.__getitem__(i)
 
     def __len__(self):
+        if self._arrays is not None:
+            return len(self._arrays[1])
         return len(self.dataframe)
+
+
+class OccupancyEstimationStream:
+    _TARGET_COLUMN = "Room_Occupancy_Count"
+
+    def __init__(
+        self,
+        path: str,
+        batch_size: int = 1024,
+        chunksize: int = 65536,
+        pipeline: DateAndTimePipeline | None = None,
+        downcast: bool = True,
+        drop_last: bool = False,
+    ):
+        if batch_size <= 0 or chunksize <= 0:
+            raise ValueError("Batch size and chunk size must be positive")
+
+        self.path = path
+        self.batch_size = batch_size
+        self.chunksize = chunksize
+        # fitted by the scan pass, then saved along a model to serve it
+        self.pipeline = pipeline or DateAndTimePipeline()
+        self.downcast = downcast
+        self.drop_last = drop_last
+
+        self.input_columns = [
+            column
+            for column in pd.read_csv(path, nrows=0).columns
+            if column != self._TARGET_COLUMN
+        ]
+        self.output_column = self._TARGET_COLUMN
+        self._fitted = False
+
+    def _scan(self):
+        self.pipeline.fit_chunks(
+            pd.read_csv(
+                self.path, chunksize=self.chunksize, usecols=self.pipeline.FIT_COLUMNS
+            )
+        )
+        self._fitted = True
+
+    def _downcast(self, chunk: pd.DataFrame) -> pd.DataFrame:
+        dtypes = {
+            column: np.float32 for column in chunk.select_dtypes("float64").columns
+        }
+        dtypes.update(
+            {
+                column: np.int32
+                for column in chunk.select_dtypes("int64").columns
+                if column != self.output_column
+            }
+        )
+        dtypes.update(
+            {
+                column: dtype
+                for column, dtype in self.pipeline.DOWNCAST_DTYPES.items()
+                if column in chunk.columns
+            }
+        )
+        return chunk.astype(dtypes)
+
+    def iterate_chunks(self):
+        # the scan pass runs once, later epochs only re-read the file
+        if not self._fitted:
+            self._scan()
+
+        for chunk in pd.read_csv(self.path, chunksize=self.chunksize):
+            chunk = self.pipeline.transform(chunk)
+            yield self._downcast(chunk) if self.downcast else chunk
+
+    def __iter__(self):
+        x_dtype = np.float32 if self.downcast else np.float64
+        x_buffer, y_buffer, buffered = [], [], 0
+
+        for chunk in self.iterate_chunks():
+            x_buffer.append(chunk[self.input_columns].to_numpy(dtype=x_dtype))
+            y_buffer.append(chunk[self.output_column].to_numpy(dtype=np.int64))
+            buffered += len(chunk)
+            if buffered < self.batch_size:
+                continue
+
+            X, y = np.concatenate(x_buffer), np.concatenate(y_buffer)
+            n_full = len(X) - len(X) % self.batch_size
+            for start in range(0, n_full, self.batch_size):
+                yield X[start : start + self.batch_size], y[
+                    start : start + self.batch_size
+                ]
+            x_buffer, y_buffer, buffered = [X[n_full:]], [y[n_full:]], len(X) - n_full
+
+        if buffered and not self.drop_last:
+            yield np.concatenate(x_buffer), np.concatenate(y_buffer)
+
+
+def test_columnar_accessors():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "occupancy.csv")
+        make_occupancy_log().to_csv(path, index=False)
+        loader = OccupancyEstimationDataloader(path, DateAndTimePreprocessor.process)
+
+    X, y = loader.to_numpy()
+    assert X.shape == (len(loader), len(loader.input_columns))
+    assert X.flags["C_CONTIGUOUS"] and y.dtype == np.int64
+    assert loader.to_numpy(np.float32)[0].dtype == np.float32
+
+    # the arrays hold the rows of the row-dict API, in the same column order
+    for i in [0, 17, len(loader) - 1]:
+        row_input, row_output = loader[i]
+        assert list(row_input) == loader.input_columns
+        assert np.array_equal(X[i], list(row_input.values()))
+        assert y[i] == row_output
+
+    X_batch, y_batch = loader[10:20]
+    assert np.array_equal(X_batch, X[10:20]) and np.array_equal(y_batch, y[10:20])
+    X_batch, y_batch = loader[np.array([3, 1, 4])]
+    assert np.array_equal(X_batch, X[[3, 1, 4]]) and np.array_equal(
+        y_batch, y[[3, 1, 4]]
+    )
+
+
+def test_cached_loader():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path, cache_dir = (os.path.join(tmp_dir, name) for name in ("log.csv", "cache"))
+        make_occupancy_log().to_csv(path, index=False)
+
+        expected = OccupancyEstimationDataloader(path, DateAndTimePreprocessor.process)
+        X, y = expected.to_numpy()
+        for _ in range(2):
+            loader = OccupancyEstimationDataloader(
+                path, DateAndTimePreprocessor.process, cache_dir=cache_dir
+            )
+            assert loader.input_columns == expected.input_columns
+            assert np.array_equal(loader.to_numpy()[0], X)
+            assert np.array_equal(loader.to_numpy()[1], y)
+        assert len(os.listdir(cache_dir)) == 3
+
+        # the second load maps the cached arrays, the CSV is not parsed
+        assert loader._dataframe is None
+        assert isinstance(loader.to_numpy()[0], np.memmap)
+        assert loader[5][0] == expected[5][0]
+        assert loader.dataframe.equals(expected.dataframe.reset_index(drop=True))
+
+        # another content is another cache entry
+        make_occupancy_log(seed=1).to_csv(path, index=False)
+        OccupancyEstimationDataloader(
+            path, DateAndTimePreprocessor.process, cache_dir=cache_dir
+        )
+        assert len(os.listdir(cache_dir)) == 6
+
+
+def test_stream():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "log.csv")
+        make_occupancy_log().to_csv(path, index=False)
+        expected = DateAndTimePreprocessor.process(pd.read_csv(path))
+        X_expected = expected.drop(columns="Room_Occupancy_Count").to_numpy()
+
+        # chunks smaller than a batch and not a multiple of it
+        stream = OccupancyEstimationStream(
+            path, batch_size=64, chunksize=50, downcast=False
+        )
+        batches = list(stream)
+        assert [len(y) for _, y in batches[:-1]] == [64] * (len(batches) - 1)
+        assert np.array_equal(np.concatenate([X for X, _ in batches]), X_expected)
+        assert np.array_equal(
+            np.concatenate([y for _, y in batches]),
+            expected["Room_Occupancy_Count"].to_numpy(),
+        )
+
+        # a second epoch yields the same batches
+        assert all(
+            np.array_equal(X, X_again)
+            for (X, _), (X_again, _) in zip(batches, stream, strict=True)
+        )
+
+        stream = OccupancyEstimationStream(path, batch_size=64, drop_last=True)
+        X_batches = [X for X, _ in stream]
+        assert all(X.shape == (64, X_expected.shape[1]) for X in X_batches)
+        assert len(X_batches) == len(X_expected) // 64
+        assert np.allclose(np.concatenate(X_batches), X_expected[: 64 * len(X_batches)])
+
+
+if __name__ == "__main__":
+    test_columnar_accessors()
+    test_cached_loader()
+    test_stream()
@@ -1,4 +1,9 @@
-from .model_runner import HyperParameter, HyperParameters
+from .model_runner import (
+    HyperParameter,
+    HyperParameters,
+    LogUniformHyperParameter,
+    UniformHyperParameter,
+)
 
 hyperparams_svr = HyperParameters(
     [
@@ -17,3 +22,27 @@ hyperparams_rf = HyperParameters(
         HyperParameter("max_features", [5, 10]),
     ]
 )
+
+hyperparams_svr_sobol = HyperParameters(
+    [
+        HyperParameter("kernel", ["poly"]),
+        HyperParameter("degree", [2]),
+        LogUniformHyperParameter("C", 1e-2, 10.0),
+        LogUniformHyperParameter("epsilon", 1e-3, 1e-1),
+    ],
+    search="sobol",
+    budget=8,
+    seed=0,
+)
+
+hyperparams_rf_sobol = HyperParameters(
+    [
+        HyperParameter("criterion", ["gini", "entropy"]),
+        UniformHyperParameter("n_estimators", 2, 30, integer=True),
+        UniformHyperParameter("max_depth", 2, 8, integer=True),
+        UniformHyperParameter("max_features", 2, 12, integer=True),
+    ],
+    search="sobol",
+    budget=16,
+    seed=0,
+)
@@ -1,8 +1,17 @@
-import time
+import cProfile
+import hashlib
+import json
+import os
+import tempfile
+import uuid
+from concurrent.futures import Executor, as_completed
 
 from .dataloader import OccupancyEstimationDataloader
+from .models.model import Model
 from .preprocessor import DateAndTimePreprocessor
+from .profiling import PhaseTimer, RunInstrumentation
 import numpy as np, scipy.stats as st
+from scipy.stats import qmc
 import shap
 
 
@@ -32,6 +41,9 @@ class CrossValidation:
 
         return x_train, y_train, x_test, y_test
 
+    def __len__(self):
+        return len(self.folds)
+
     def for_each_fold(self, action: callable):
         for k in range(len(self.folds)):
             x_train, y_train, x_test, y_test = self.get_fold_iteration(k)
@@ -62,10 +74,63 @@ class HyperParameter:
     def reset_index(self):
         self.value_index = 0
 
+    def from_unit(self, u: float):
+        # maps a point of [0, 1) to a value, used by random / quasi-random search
+        return self.values[min(int(u * len(self.values)), len(self.values) - 1)]
+
+
+class UniformHyperParameter(HyperParameter):
+    def __init__(self, key: str, low: float, high: float, integer: bool = False):
+        if low >= high:
+            raise ValueError(f"Invalid range for {key}: [{low}, {high}]")
+        super().__init__(key, values=None)
+        self.low = low
+        self.high = high
+        self.integer = integer
+
+    def _scale(self, u: float, low: float, high: float) -> float:
+        return low + u * (high - low)
+
+    def from_unit(self, u: float):
+        if self.integer:
+            # every integer of [low, high] gets a bin of the same width
+            value = np.floor(self._scale(u, self.low, self.high + 1))
+            return int(min(value, self.high))
+        return float(self._scale(u, self.low, self.high))
+
+
+class LogUniformHyperParameter(UniformHyperParameter):
+    def __init__(self, key: str, low: float, high: float, integer: bool = False):
+        if low <= 0:
+            raise ValueError(f"Log-uniform range for {key} must be positive")
+        super().__init__(key, low, high, integer)
+
+    def _scale(self, u: float, low: float, high: float) -> float:
+        return float(np.exp(np.log(low) + u * np.log(high / low)))
+
 
 class HyperParameters:
-    def __init__(self, params: list[HyperParameter]):
+    _SEARCH_METHODS = ["grid", "random", "sobol"]
+
+    def __init__(
+        self,
+        params: list[HyperParameter],
+        search: str = "grid",
+        budget: int | None = None,
+        seed: int | None = None,
+    ):
+        if search not in self._SEARCH_METHODS:
+            raise ValueError(
+                f"Invalid search method! Allowed methods: {self._SEARCH_METHODS}"
+            )
+        if search != "grid" and not budget:
+            raise ValueError(f"A budget is required for {search} search")
+
         self.params: list[HyperParameter] = params
+        self.search = search
+        self.budget = budget
+        # fix the seed to resume a checkpointed sampled search
+        self.seed = seed
 
     def add_param(self, param: HyperParameter):
         self.params.append(param)
@@ -74,7 +139,15 @@ class HyperParameters:
         return {p.key: p.get_current_value() for p in self.params}
 
     def iterate_configs(self):
+        if self.search == "grid":
+            yield from self._iterate_grid()
+        else:
+            yield from self._iterate_sampled()
+
+    def _iterate_grid(self):
         for param in self.params:
+            if param.values is None:
+                raise ValueError(f"Cannot grid-search the range of {param.key}")
             param.reset_index()
         stack = [self.params[0]]
 
@@ -87,6 +160,19 @@ class HyperParameters:
             while len(stack) > 0 and stack[-1].advance_index():
                 stack.pop()
 
+    def _sample_unit_points(self) -> np.ndarray:
+        if self.search == "random":
+            rng = np.random.default_rng(self.seed)
+            return rng.random((self.budget, len(self.params)))
+
+        # draw a power-of-two sized Sobol sequence to keep its balance properties
+        sobol = qmc.Sobol(d=len(self.params), scramble=True, seed=self.seed)
+        return sobol.random_base2(int(np.ceil(np.log2(self.budget))))[: self.budget]
+
+    def _iterate_sampled(self):
+        for point in self._sample_unit_points():
+            yield {p.key: p.from_unit(u) for p, u in zip(self.params, point)}
+
 
 class MetricEstimate:
     def __init__(self, values):
@@ -101,16 +187,77 @@ class MetricEstimate:
         return f"{{ mean={self.mean}, std={self.std}, conf_interval={self.conf_interval} }}"
 
 
+class ConfusionMatrix:
+    def __init__(self, y_true, y_pred, n_classes: int):
+        y_true = np.asarray(y_true).astype(int)
+        y_pred = np.asarray(y_pred).astype(int)
+        if len(y_true) and (
+            min(y_true.min(), y_pred.min()) < 0
+            or max(y_true.max(), y_pred.max()) >= n_classes
+        ):
+            raise ValueError(f"Labels must be in the range [0, {n_classes})")
+
+        # rows are true labels, columns are predicted labels
+        self.matrix = np.bincount(
+            y_true * n_classes + y_pred, minlength=n_classes * n_classes
+        ).reshape(n_classes, n_classes)
+
+        self.total = self.matrix.sum()
+        self.tp = np.diag(self.matrix)
+        self.fp = self.matrix.sum(axis=0) - self.tp
+        self.fn = self.matrix.sum(axis=1) - self.tp
+
+    @classmethod
+    def _safe_divide(cls, num, den):
+        num, den = np.asarray(num, dtype=float), np.asarray(den, dtype=float)
+        ratio = np.divide(num, den, out=np.zeros_like(num), where=den > 0)
+        return ratio if ratio.ndim else float(ratio)
+
+    def accuracy(self):
+        return self._safe_divide(self.tp.sum(), self.total)
+
+    def precision(self):
+        return self._safe_divide(self.tp, self.tp + self.fp)
+
+    def recall(self):
+        return self._safe_divide(self.tp, self.tp + self.fn)
+
+    def f_measure(self):
+        return self._safe_divide(2 * self.tp, 2 * self.tp + self.fp + self.fn)
+
+    def micro_precision(self):
+        return self._safe_divide(self.tp.sum(), self.tp.sum() + self.fp.sum())
+
+    def micro_recall(self):
+        return self._safe_divide(self.tp.sum(), self.tp.sum() + self.fn.sum())
+
+    def micro_f_measure(self):
+        tp, fp, fn = self.tp.sum(), self.fp.sum(), self.fn.sum()
+        return self._safe_divide(2 * tp, 2 * tp + fp + fn)
+
+
 class PredictionMetrics:
-    def __init__(self, metrics: dict[str, callable], best_measure: tuple[str, str]):
+    def __init__(
+        self,
+        metrics: dict[str, callable],
+        best_measure: tuple[str, str],
+        summarize: callable = None,
+    ):
         self.metrics = metrics
         self.best_measure = best_measure
+        # computes a shared summary (e.g. a confusion matrix) once per fold,
+        # every metric then receives the summary instead of (y_true, y_pred)
+        self.summarize = summarize
 
     def keys(self):
         return self.metrics.keys()
 
     def apply(self, y_true, y_pred):
-        return {name: fun(y_true, y_pred) for name, fun in self.metrics.items()}
+        if self.summarize is None:
+            return {name: fun(y_true, y_pred) for name, fun in self.metrics.items()}
+
+        summary = self.summarize(y_true, y_pred)
+        return {name: fun(summary) for name, fun in self.metrics.items()}
 
     def is_better(
         self, old_m: dict[str, MetricEstimate] | None, new_m: dict[str, MetricEstimate]
@@ -146,83 +293,339 @@ class PredictionMetrics:
         )
 
     @staticmethod
-    def classification_metrics():
-        def conf_mat(y_true, y_pred, action):
-            TP = ((y_pred == 1) & (y_true == 1)).sum()
-            FP = ((y_pred == 1) & (y_true == 0)).sum()
-            TN = ((y_pred == 0) & (y_true == 0)).sum()
-            FN = ((y_pred == 0) & (y_true == 1)).sum()
-            return action(TP, FP, TN, FN)
+    def classification_metrics(n_classes: int = 2):
+        if n_classes < 2:
+            raise ValueError(f"Invalid number of classes: {n_classes}")
+
+        def summarize(y_true, y_pred):
+            return ConfusionMatrix(y_true, y_pred, n_classes)
+
+        if n_classes == 2:
+            # binary task: report the metrics of the positive class
+            metrics = {
+                "accuracy": lambda cm: cm.accuracy(),
+                "precision": lambda cm: cm.precision()[1],
+                "recall": lambda cm: cm.recall()[1],
+                "f_measure": lambda cm: cm.f_measure()[1],
+            }
+        else:
+            metrics = {
+                "accuracy": lambda cm: cm.accuracy(),
+                "macro_precision": lambda cm: np.mean(cm.precision()),
+                "macro_recall": lambda cm: np.mean(cm.recall()),
+                "macro_f_measure": lambda cm: np.mean(cm.f_measure()),
+                "micro_precision": lambda cm: cm.micro_precision(),
+                "micro_recall": lambda cm: cm.micro_recall(),
+                "micro_f_measure": lambda cm: cm.micro_f_measure(),
+            }
 
         return PredictionMetrics(
-            {
-                "accuracy": lambda y_true, y_pred: conf_mat(
-                    y_true,
-                    y_pred,
-                    lambda TP, FP, TN, FN: (TP + TN) / (TP + TN + FP + FN),
-                ),
-                "precision": lambda y_true, y_pred: conf_mat(
-                    y_true, y_pred, lambda TP, FP, TN, FN: TP / (TP + FP)
-                ),
-                "recall": lambda y_true, y_pred: conf_mat(
-                    y_true, y_pred, lambda TP, FP, TN, FN: TP / (TP + FN + 1e-9)
-                ),
-                "f_measure": lambda y_true, y_pred: conf_mat(
-                    y_true,
-                    y_pred,
-                    lambda TP, FP, TN, FN: 2 * TP / (2 * TP + FP + FN + 1e-9),
-                ),
+            metrics, best_measure=("accuracy", "max"), summarize=summarize
+        )
+
+
+class GridSearchCheckpoint:
+    _RESULTS_FILE = "results.jsonl"
+    _INCUMBENT_FILE = "incumbent.json"
+    _FINGERPRINT_FILE = "fingerprint.json"
+
+    def __init__(
+        self, directory: str, resume: bool = False, fingerprint: dict | None = None
+    ):
+        """
+        `fingerprint` identifies what the fold scores were computed on (the
+        data, the model type, the metrics); resuming a checkpoint written
+        with a different one is refused, its scores would not be comparable.
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.results_path = os.path.join(directory, self._RESULTS_FILE)
+        self.incumbent_path = os.path.join(directory, self._INCUMBENT_FILE)
+        self.fingerprint_path = os.path.join(directory, self._FINGERPRINT_FILE)
+        fingerprint = fingerprint or {}
+
+        if resume and os.path.exists(self.results_path):
+            saved = None
+            if os.path.exists(self.fingerprint_path):
+                with open(self.fingerprint_path, "r") as f:
+                    saved = json.load(f)
+            if saved != fingerprint:
+                raise ValueError(
+                    f"Checkpoint in {directory} was written for {saved}, not for "
+                    f"{fingerprint}: refusing to resume, run with resume=False"
+                )
+
+        if not resume:
+            for path in (self.results_path, self.incumbent_path):
+                if os.path.exists(path):
+                    os.remove(path)
+        self._atomic_write(self.fingerprint_path, json.dumps(fingerprint, indent=4))
+
+        self.completed = self._load_results()
+
+    @classmethod
+    def config_key(cls, hp_cfg: dict) -> str:
+        return json.dumps(hp_cfg, sort_keys=True, default=str)
+
+    def _load_results(self) -> dict[tuple[str, int], dict[str, float]]:
+        if not os.path.exists(self.results_path):
+            return {}
+
+        completed, valid_lines, corrupted = {}, [], False
+        with open(self.results_path, "r") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # last line of a process killed in the middle of a write
+                    corrupted = True
+                    continue
+                completed[(self.config_key(entry["config"]), entry["fold"])] = entry[
+                    "metrics"
+                ]
+                valid_lines.append(line if line.endswith("\n") else line + "\n")
+
+        if corrupted:
+            self._atomic_write(self.results_path, "".join(valid_lines))
+        return completed
+
+    @classmethod
+    def _atomic_write(cls, path: str, content: str):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def get(self, hp_cfg: dict, k: int) -> dict[str, float] | None:
+        return self.completed.get((self.config_key(hp_cfg), k))
+
+    def record(self, hp_cfg: dict, k: int, m_vals: dict):
+        m_vals = {name: float(value) for name, value in m_vals.items()}
+        entry = {"config": hp_cfg, "fold": k, "metrics": m_vals}
+        with open(self.results_path, "a") as f:
+            f.write(json.dumps(entry, default=str) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.completed[(self.config_key(hp_cfg), k)] = m_vals
+
+    def save_incumbent(self, hp_cfg: dict, metric_vals: dict[str, "MetricEstimate"]):
+        incumbent = {
+            "config": hp_cfg,
+            "metrics": {
+                name: {
+                    "mean": float(estimate.mean),
+                    "std": float(estimate.std),
+                    "conf_interval": [float(v) for v in estimate.conf_interval],
+                }
+                for name, estimate in metric_vals.items()
             },
-            best_measure=("accuracy", "max"),
+        }
+        self._atomic_write(
+            self.incumbent_path, json.dumps(incumbent, indent=4, default=str)
+        )
+
+
+def _fit_predict(
+    model_type: type,
+    hp_cfg: dict,
+    x_train,
+    y_train,
+    x_test,
+    trace_memory: bool = False,
+):
+    # module-level so that it can be shipped to process pool workers
+    timer = PhaseTimer()
+    model = model_type(**hp_cfg)
+    with timer.phase("fit"):
+        model.fit(x_train, y_train)
+    with timer.phase("predict"):
+        y_pred = model.predict(x_test)
+
+    phases = timer.phases
+    if trace_memory:
+        phases.update(
+            _instrumented_fit_predict(
+                model_type, hp_cfg, x_train, y_train, x_test, trace_memory=True
+            )
         )
+    return y_pred, phases
+
+
+def _instrumented_fit_predict(
+    model_type: type,
+    hp_cfg: dict,
+    x_train,
+    y_train,
+    x_test,
+    trace_memory: bool = False,
+    profile_path: str | None = None,
+) -> dict:
+    # a second pass under tracemalloc and/or cProfile, which slow the model
+    # down several times: only the memory peaks are kept, never the timings
+    profiler = cProfile.Profile() if profile_path else None
+
+    with PhaseTimer(trace_memory=trace_memory, profiler=profiler) as timer:
+        model = model_type(**hp_cfg)
+        with timer.phase("fit"):
+            model.fit(x_train, y_train)
+        with timer.phase("predict"):
+            model.predict(x_test)
+
+    if profiler:
+        profiler.dump_stats(profile_path)
+    return {
+        name: value
+        for name, value in timer.phases.items()
+        if name.endswith("_peak_bytes")
+    }
+
+
+def _explain_rows(
+    model,
+    pred_caller: callable,
+    background: np.ndarray,
+    feature_names: list,
+    x_rows: np.ndarray,
+    batch_size: int,
+    seed: int | None = None,
+) -> tuple[np.ndarray, np.ndarray]:
+    # module level so that process pool workers can unpickle it, the fitted
+    # model and pred_caller are shipped instead of the (unpicklable) closure
+    masker = shap.maskers.Independent(background, max_samples=len(background))
+    explainer = shap.Explainer(
+        pred_caller(model), masker, feature_names=feature_names, seed=seed
+    )
+    explanation = explainer(x_rows, batch_size=batch_size, silent=True)
+    return explanation.values, explanation.base_values
 
 
 class ModelRunner:
-    def __init__(self, dataset_path: str):
+    def __init__(
+        self,
+        dataset_path: str,
+        binary_target: bool = True,
+        cache_dir: str | None = None,
+        seed: int | None = 0,
+    ):
         loader = OccupancyEstimationDataloader(
-            dataset_path, DateAndTimePreprocessor.process
+            dataset_path, DateAndTimePreprocessor.process, cache_dir=cache_dir
         )
         self.columns = columns = loader.input_columns
 
-        X, Y = [], []
-        for _x, _y in loader:
-            X.append([_x[col] for col in columns])
-            Y.append(1 if _y > 0 else 0)
-        X, Y = np.array(X), np.array(Y)
+        X, Y = loader.to_numpy()
+        if binary_target:
+            Y = (Y > 0).astype(Y.dtype)
 
-        indices = np.arange(len(X))
-        np.random.shuffle(indices)
+        # seeded, so that the subsample and the folds are the same in every
+        # process resuming a checkpoint
+        indices = np.random.default_rng(seed).permutation(len(X))
         self.X, self.Y = X[indices], Y[indices]
         self.X, self.Y = self.X[:1000], self.Y[:1000]
         print(self.X.shape, self.Y.shape)
 
-        self.cross_validation = CrossValidation(self.X, self.Y)
-
-    def run(self, model_type: type, hp: HyperParameters, metrics: PredictionMetrics):
-        def perform_cv(hp_cfg):
-            metric_vals = {key: [] for key in [*metrics.keys(), "exec_time"]}
+        digest = hashlib.sha256(np.ascontiguousarray(self.X).tobytes())
+        digest.update(np.ascontiguousarray(self.Y).tobytes())
+        self.data_fingerprint = digest.hexdigest()
 
-            def process_fold(x_train, y_train, x_test, y_test, k):
-                print(f"Fold {k}")
-                model = model_type(**hp_cfg)
+        self.cross_validation = CrossValidation(self.X, self.Y)
 
-                start_time = time.time()
-                model.fit(x_train, y_train)
-                exec_time = time.time() - start_time
+    def run(
+        self,
+        model_type: type,
+        hp: HyperParameters,
+        metrics: PredictionMetrics,
+        checkpoint_dir: str | None = None,
+        resume: bool = False,
+        executor: Executor | None = None,
+        instrumentation: RunInstrumentation | None = None,
+    ):
+        instrumentation = instrumentation or RunInstrumentation()
+        checkpoint = None
+        if checkpoint_dir:
+            fingerprint = {
+                "data": self.data_fingerprint,
+                "model_type": f"{model_type.__module__}.{model_type.__qualname__}",
+                "metrics": sorted(metrics.keys()),
+            }
+            checkpoint = GridSearchCheckpoint(
+                checkpoint_dir, resume=resume, fingerprint=fingerprint
+            )
 
-                y_pred = model.predict(x_test)
-                m_vals = {**metrics.apply(y_test, y_pred), "exec_time": exec_time}
-                print(m_vals)
+        # (fit + predict ns, config, fold) of the slowest fold timed by this run
+        slowest = None
 
-                for key, value in m_vals.items():
-                    metric_vals[key].append(value)
+        def evaluate_fold(hp_cfg, k, y_test, y_pred, phases):
+            nonlocal slowest
+            timer = PhaseTimer()
+            with timer.phase("metrics"):
+                m_vals = metrics.apply(y_test, y_pred)
+            phases = {**phases, **timer.phases}
 
-            self.cross_validation.for_each_fold(process_fold)
+            m_vals["exec_time"] = phases["fit_ns"] / 1e9
+            print(f"Fold {k}: {m_vals}")
+            if checkpoint:
+                checkpoint.record(hp_cfg, k, m_vals)
+            instrumentation.on_fold_end(hp_cfg, k, phases)
 
-            for key in metric_vals.keys():
-                metric_vals[key] = MetricEstimate(metric_vals[key])
+            fold_ns = phases["fit_ns"] + phases["predict_ns"]
+            if slowest is None or fold_ns > slowest[0]:
+                slowest = (fold_ns, hp_cfg, k)
+            return m_vals
 
-            return metric_vals
+        def perform_cv(hp_cfg):
+            instrumentation.on_config_start(hp_cfg)
+            fold_vals, pending = {}, []
+            for k in range(len(self.cross_validation)):
+                restored = checkpoint.get(hp_cfg, k) if checkpoint else None
+                if restored is not None:
+                    print(f"Fold {k} restored from checkpoint")
+                    fold_vals[k] = restored
+                else:
+                    pending.append(k)
+
+            if executor is None:
+                for k in pending:
+                    print(f"Fold {k}")
+                    x_train, y_train, x_test, y_test = (
+                        self.cross_validation.get_fold_iteration(k)
+                    )
+                    y_pred, phases = _fit_predict(
+                        model_type,
+                        hp_cfg,
+                        x_train,
+                        y_train,
+                        x_test,
+                        instrumentation.trace_memory,
+                    )
+                    fold_vals[k] = evaluate_fold(hp_cfg, k, y_test, y_pred, phases)
+            else:
+                futures = {}
+                for k in pending:
+                    x_train, y_train, x_test, y_test = (
+                        self.cross_validation.get_fold_iteration(k)
+                    )
+                    future = executor.submit(
+                        _fit_predict,
+                        model_type,
+                        hp_cfg,
+                        x_train,
+                        y_train,
+                        x_test,
+                        instrumentation.trace_memory,
+                    )
+                    futures[future] = (k, y_test)
+
+                # checkpoint every fold as soon as it finishes, in completion order
+                for future in as_completed(futures):
+                    k, y_test = futures[future]
+                    y_pred, phases = future.result()
+                    fold_vals[k] = evaluate_fold(hp_cfg, k, y_test, y_pred, phases)
+
+            return {
+                key: MetricEstimate([fold_vals[k][key] for k in sorted(fold_vals)])
+                for key in [*metrics.keys(), "exec_time"]
+            }
 
         best_hp_cfg = {}
         best_metrics = None
@@ -233,10 +636,66 @@ class ModelRunner:
             if metrics.is_better(best_metrics, metric_vals):
                 best_metrics = metric_vals
                 best_hp_cfg = hp_cfg
+                if checkpoint:
+                    checkpoint.save_incumbent(best_hp_cfg, best_metrics)
+
+        if instrumentation.profile_dir and slowest:
+            # only the slowest fold is profiled, once its timing is known
+            _, hp_cfg, k = slowest
+            x_train, y_train, x_test, _ = self.cross_validation.get_fold_iteration(k)
+            profile_path = os.path.join(
+                instrumentation.profile_dir, f"{uuid.uuid4().hex}.prof"
+            )
+            _instrumented_fit_predict(
+                model_type,
+                hp_cfg,
+                x_train,
+                y_train,
+                x_test,
+                profile_path=profile_path,
+            )
+            instrumentation.on_profile(hp_cfg, k, profile_path)
 
         return best_hp_cfg, best_metrics
 
-    def shap(self, model_type, params, pred_caller=lambda x: x, show: bool = True):
+    def shap(
+        self,
+        model_type,
+        params,
+        pred_caller=lambda x: x,
+        show: bool = True,
+        background_size: int = 100,
+        batch_size: int = 50,
+        executor: Executor | None = None,
+        rows_per_task: int = 16,
+        values_path: str | None = None,
+        seed: int | None = 0,
+    ):
+        """
+        Explains the test rows of the first fold with a background-data
+        masker: every coalition is evaluated against `background_size`
+        training rows, `batch_size` coalitions per model call. The rows are
+        split in tasks of `rows_per_task` when an executor is given, for a
+        process pool both the model and `pred_caller` have to be picklable.
+
+        If `values_path` points to a .npz saved for the same model type,
+        parameters and data, the values are loaded from it instead of being
+        recomputed, otherwise they are computed and saved there.
+        """
+        fingerprint = {
+            "model_type": f"{model_type.__module__}.{model_type.__qualname__}",
+            "params": json.dumps(params, sort_keys=True, default=str),
+            "data": self.data_fingerprint,
+        }
+        if values_path:
+            values_path = self.shap_values_path(values_path)
+        if values_path and os.path.exists(values_path):
+            shap_values, saved_fingerprint = self.load_shap_values(values_path)
+            if saved_fingerprint == fingerprint:
+                shap.waterfall_plot(shap_values[0], show=show)
+                return shap_values
+            print(f"{values_path} was computed for another model, recomputing")
+
         model = model_type(**params)
 
         ex_train = []
@@ -244,20 +703,228 @@ class ModelRunner:
         ey_test = []
 
         def process_fold(x_train, y_train, x_test, y_test, k):
-            nonlocal ex_test, ey_test
+            nonlocal ex_train, ex_test, ey_test
             model.fit(x_train, y_train)
+            ex_train = x_train
             ex_test = x_test
             ey_test = y_test
 
         self.cross_validation.for_one_fold(process_fold)
 
-        def masker(mask, x):
-            return x.reshape(1, -1)
+        rng = np.random.default_rng(seed)
+        background = ex_train[
+            rng.choice(
+                len(ex_train), min(background_size, len(ex_train)), replace=False
+            )
+        ]
 
-        explainer = shap.Explainer(
-            pred_caller(model),
-            masker,
+        tasks = [
+            ex_test[start : start + rows_per_task]
+            for start in range(0, len(ex_test), rows_per_task)
+        ]
+        if executor is None:
+            results = [
+                _explain_rows(
+                    model,
+                    pred_caller,
+                    background,
+                    self.columns,
+                    rows,
+                    batch_size,
+                    seed,
+                )
+                for rows in tasks
+            ]
+        else:
+            futures = [
+                executor.submit(
+                    _explain_rows,
+                    model,
+                    pred_caller,
+                    background,
+                    self.columns,
+                    rows,
+                    batch_size,
+                    seed,
+                )
+                for rows in tasks
+            ]
+            results = [future.result() for future in futures]
+
+        shap_values = shap.Explanation(
+            values=np.concatenate([values for values, _ in results]),
+            base_values=np.concatenate([base_values for _, base_values in results]),
+            data=ex_test,
             feature_names=self.columns,
         )
-        shap_values = explainer(ex_test)
+        if values_path:
+            self.save_shap_values(shap_values, values_path, fingerprint)
+
         shap.waterfall_plot(shap_values[0], show=show)
+        return shap_values
+
+    @classmethod
+    def shap_values_path(cls, path: str) -> str:
+        # np.savez appends the extension to paths without it
+        return path if path.endswith(".npz") else f"{path}.npz"
+
+    @classmethod
+    def save_shap_values(cls, shap_values, path: str, fingerprint: dict | None = None):
+        np.savez(
+            cls.shap_values_path(path),
+            values=shap_values.values,
+            base_values=shap_values.base_values,
+            data=shap_values.data,
+            feature_names=np.array(shap_values.feature_names),
+            fingerprint=np.array(json.dumps(fingerprint or {}, sort_keys=True)),
+        )
+
+    @classmethod
+    def load_shap_values(cls, path: str) -> tuple[object, dict]:
+        with np.load(cls.shap_values_path(path)) as saved:
+            shap_values = shap.Explanation(
+                values=saved["values"],
+                base_values=saved["base_values"],
+                data=saved["data"],
+                feature_names=saved["feature_names"].tolist(),
+            )
+            # files saved before the fingerprint was stored never match
+            fingerprint = {}
+            if "fingerprint" in saved.files:
+                fingerprint = json.loads(saved["fingerprint"].item())
+        return shap_values, fingerprint
+
+
+def test_sampled_search():
+    params = [
+        HyperParameter("kernel", ["linear", "rbf"]),
+        UniformHyperParameter("depth", 2, 5, integer=True),
+        LogUniformHyperParameter("C", 1e-3, 1e3),
+    ]
+    for search in ["random", "sobol"]:
+        configs = list(
+            HyperParameters(params, search, budget=50, seed=1).iterate_configs()
+        )
+        assert len(configs) == 50
+        assert {cfg["kernel"] for cfg in configs} == {"linear", "rbf"}
+        # every integer of the range is drawn, the upper bound included
+        assert {cfg["depth"] for cfg in configs} == {2, 3, 4, 5}
+        assert all(1e-3 <= cfg["C"] <= 1e3 for cfg in configs)
+        # log-uniform: about as many draws below 1 as above
+        assert 15 <= sum(cfg["C"] < 1 for cfg in configs) <= 35
+
+        # the same seed draws the same configs, as resuming a search needs
+        assert configs == list(
+            HyperParameters(params, search, budget=50, seed=1).iterate_configs()
+        )
+
+    try:
+        list(HyperParameters(params).iterate_configs())
+        assert False, "grid-searched a continuous range"
+    except ValueError:
+        pass
+
+
+def test_confusion_matrix():
+    y_true = [0, 0, 1, 1, 1, 2, 2, 2, 2]
+    y_pred = [0, 1, 1, 1, 2, 2, 2, 0, 2]
+    cm = ConfusionMatrix(y_true, y_pred, n_classes=3)
+    assert (cm.matrix == [[1, 1, 0], [0, 2, 1], [1, 0, 3]]).all()
+    assert cm.accuracy() == 6 / 9
+    assert np.allclose(cm.precision(), [1 / 2, 2 / 3, 3 / 4])
+    assert np.allclose(cm.recall(), [1 / 2, 2 / 3, 3 / 4])
+    assert np.allclose(cm.f_measure(), [1 / 2, 2 / 3, 3 / 4])
+    assert cm.micro_f_measure() == cm.accuracy()
+
+    # the binary metrics are the ones of the positive class
+    m_vals = PredictionMetrics.classification_metrics().apply(
+        np.array([0, 0, 1, 1, 1]), np.array([0, 1, 1, 1, 0])
+    )
+    assert m_vals == {
+        "accuracy": 3 / 5,
+        "precision": 2 / 3,
+        "recall": 2 / 3,
+        "f_measure": 2 / 3,
+    }
+
+    # a class absent from both labels and predictions scores 0, not nan
+    assert ConfusionMatrix([0, 0], [0, 0], n_classes=2).precision()[1] == 0.0
+    try:
+        ConfusionMatrix([0, 3], [0, 1], n_classes=3)
+        assert False, "accepted a label out of range"
+    except ValueError:
+        pass
+
+
+class _ThresholdModel(Model):
+    # predicts the first feature above a threshold, every fit is logged and
+    # the fit of index `fail_at` raises, as a search killed halfway would
+    fits = []
+    fail_at = None
+
+    def __init__(self, threshold: float):
+        self.threshold = threshold
+
+    def fit(self, X, y, *args, **kwargs):
+        if len(_ThresholdModel.fits) == _ThresholdModel.fail_at:
+            raise RuntimeError("search interrupted")
+        _ThresholdModel.fits.append(self.threshold)
+
+    def _predict_batch(self, X):
+        return (X[:, 0] > self.threshold).astype(int)
+
+
+def _synthetic_runner(n_rows: int = 90, n_folds: int = 3, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    runner = ModelRunner.__new__(ModelRunner)
+    runner.X = rng.random((n_rows, 2))
+    runner.Y = (runner.X[:, 0] > 0.5).astype(int)
+    runner.columns = ["x0", "x1"]
+    runner.data_fingerprint = "synthetic"
+    runner.cross_validation = CrossValidation(runner.X, runner.Y, n_folds)
+    return runner
+
+
+def test_grid_search_checkpoint():
+    runner = _synthetic_runner()
+    hp = HyperParameters([HyperParameter("threshold", [0.25, 0.5, 0.75])])
+    metrics = PredictionMetrics.classification_metrics()
+
+    with tempfile.TemporaryDirectory() as checkpoint_dir:
+        _ThresholdModel.fits, _ThresholdModel.fail_at = [], 4
+        try:
+            runner.run(_ThresholdModel, hp, metrics, checkpoint_dir)
+            assert False, "the search was not interrupted"
+        except RuntimeError:
+            pass
+
+        # the 4 completed folds are restored, only the 5 others are fitted
+        _ThresholdModel.fits, _ThresholdModel.fail_at = [], None
+        best_cfg, best_metrics = runner.run(
+            _ThresholdModel, hp, metrics, checkpoint_dir, resume=True
+        )
+        assert _ThresholdModel.fits == [0.5, 0.5, 0.75, 0.75, 0.75]
+        assert best_cfg == {"threshold": 0.5}
+        assert best_metrics["accuracy"].mean == 1.0
+
+        with open(os.path.join(checkpoint_dir, "incumbent.json"), "r") as f:
+            assert json.load(f)["config"] == best_cfg
+
+        # scores of other metrics are not comparable with the checkpointed ones
+        try:
+            runner.run(
+                _ThresholdModel,
+                hp,
+                PredictionMetrics.regression_metrics(),
+                checkpoint_dir,
+                resume=True,
+            )
+            assert False, "resumed a checkpoint of other metrics"
+        except ValueError:
+            pass
+
+
+if __name__ == "__main__":
+    test_sampled_search()
+    test_confusion_matrix()
+    test_grid_search_checkpoint()
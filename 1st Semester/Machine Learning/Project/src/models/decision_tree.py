@@ -1,3 +1,5 @@
+from math import factorial
+
 import numpy as np
 
 from .model import Model
@@ -27,6 +29,8 @@ class DecisionTree(Model):
         self.impurity = self._gini if method == "gini" else self._entropy
         self.tree = None
         self.max_depth = max_depth
+        self.n_classes = 0
+        self.feature_importances_ = None
 
     def _information_gain(self, feat: np.ndarray, left_idx: int, right_idx: int):
         parent_impurity = self.impurity(feat)
@@ -62,17 +66,25 @@ class DecisionTree(Model):
                         "threshold": threshold,
                         "left_idx": left_idx,
                         "right_idx": right_idx,
+                        "gain": gain,
                     }
 
         return best_split
 
+    def _leaf(self, y: np.ndarray):
+        counts = np.bincount(y, minlength=self.n_classes)
+        return {"value": counts.argmax(), "counts": counts, "n_samples": len(y)}
+
     def _build_tree(self, X: np.ndarray, y: np.ndarray, depth: int):
         if len(np.unique(y)) == 1 or (self.max_depth and depth >= self.max_depth):
-            return {"value": np.bincount(y).argmax()}
+            return self._leaf(y)
 
         split = self._best_split(X, y)
         if not split:
-            return {"value": np.bincount(y).argmax()}
+            return self._leaf(y)
+
+        # weighted impurity decrease, normalized at the end of fit
+        self.feature_importances_[split["feature_idx"]] += len(y) * split["gain"]
 
         left_subtree = self._build_tree(
             X[split["left_idx"]], y[split["left_idx"]], depth=depth + 1
@@ -86,23 +98,112 @@ class DecisionTree(Model):
             "threshold": split["threshold"],
             "left": left_subtree,
             "right": right_subtree,
+            "n_samples": len(y),
         }
 
     def fit(self, X: np.ndarray, y: np.ndarray, *args, **kwargs):
+        self.n_classes = int(np.max(y)) + 1
+        self.feature_importances_ = np.zeros(X.shape[1])
         self.tree = self._build_tree(X, y, depth=0)
 
-    def _predict_single(self, x: np.ndarray, tree: dict):
+        total_importance = self.feature_importances_.sum()
+        if total_importance > 0:
+            self.feature_importances_ /= total_importance
+
+    def _route_batch(self, X: np.ndarray, tree: dict, indices: np.ndarray, action):
+        # send every row of the batch down the tree at once, one mask per node
         if "value" in tree:
-            return tree["value"]
+            action(tree, indices)
+            return
+
+        go_left = X[indices, tree["feature_idx"]] <= tree["threshold"]
+        self._route_batch(X, tree["left"], indices[go_left], action)
+        self._route_batch(X, tree["right"], indices[~go_left], action)
+
+    def _predict_batch(self, X: np.ndarray) -> np.ndarray:
+        y = np.zeros(len(X), dtype=int)
+
+        def assign(leaf, indices):
+            y[indices] = leaf["value"]
 
-        feature_value = x[tree["feature_idx"]]
-        if feature_value <= tree["threshold"]:
-            return self._predict_single(x, tree["left"])
-        else:
-            return self._predict_single(x, tree["right"])
+        self._route_batch(X, self.tree, np.arange(len(X)), assign)
+        return y
 
-    def predict_one(self, X: np.ndarray, *args, **kwargs):
-        return self._predict_single(X, self.tree)
+    def _predict_proba_batch(self, X: np.ndarray) -> np.ndarray:
+        proba = np.zeros((len(X), self.n_classes))
+
+        def assign(leaf, indices):
+            proba[indices] = leaf["counts"] / np.sum(leaf["counts"])
+
+        self._route_batch(X, self.tree, np.arange(len(X)), assign)
+        return proba
+
+    def _iterate_leaf_paths(self, tree: dict, path: list):
+        if "value" in tree:
+            yield tree, path
+            return
+
+        for child, goes_left in ((tree["left"], True), (tree["right"], False)):
+            cover_ratio = child["n_samples"] / tree["n_samples"]
+            yield from self._iterate_leaf_paths(
+                child,
+                path
+                + [(tree["feature_idx"], tree["threshold"], goes_left, cover_ratio)],
+            )
+
+    def explain(self, X: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Exact path-dependent TreeSHAP values of the class probabilities.
+
+        Every leaf contributes a product game over the distinct features on
+        its path: a missing feature weights the leaf by the cover fraction of
+        its splits, a present one by whether x satisfies them. The Shapley
+        values of such a game are read off the polynomial
+        prod_j (zero_j + one_j * t), which is evaluated for all rows at once.
+
+        Returns the SHAP values (n_rows, n_features, n_classes) and the
+        expected value (n_classes,), which add up to predict_proba(X).
+        """
+        X = np.asarray(X)
+        n_rows = len(X)
+        shap_values = np.zeros((n_rows, X.shape[1], self.n_classes))
+        expected_value = np.zeros(self.n_classes)
+
+        for leaf, path in self._iterate_leaf_paths(self.tree, []):
+            value = leaf["counts"] / leaf["n_samples"]
+
+            # merge the splits on the same feature along the path
+            features = list(dict.fromkeys(feature_idx for feature_idx, *_ in path))
+            zero = np.ones(len(features))
+            one = np.ones((n_rows, len(features)))
+            for feature_idx, threshold, goes_left, cover_ratio in path:
+                pos = features.index(feature_idx)
+                zero[pos] *= cover_ratio
+                if goes_left:
+                    one[:, pos] *= X[:, feature_idx] <= threshold
+                else:
+                    one[:, pos] *= X[:, feature_idx] > threshold
+
+            expected_value += value * np.prod(zero)
+
+            d = len(features)
+            weights = np.array(
+                [factorial(k) * factorial(d - k - 1) / factorial(d) for k in range(d)]
+            )
+            for i, feature_idx in enumerate(features):
+                poly = np.zeros((n_rows, d))
+                poly[:, 0] = 1.0
+                for j in range(d):
+                    if j == i:
+                        continue
+                    shifted = poly * zero[j]
+                    shifted[:, 1:] += poly[:, :-1] * one[:, j : j + 1]
+                    poly = shifted
+
+                contribution = (one[:, i] - zero[i]) * (poly @ weights)
+                shap_values[:, feature_idx] += contribution[:, None] * value[None, :]
+
+        return shap_values, expected_value
 
 
 def test_decision_tree():
@@ -117,6 +218,11 @@ def test_decision_tree():
         print(f"Predictions {method}: {predictions}")
         print(f"Tree {method}: {tree.tree}")
 
+        shap_values, expected_value = tree.explain(X)
+        assert np.allclose(
+            expected_value + shap_values.sum(axis=1), tree.predict_proba(X)
+        )
+
 
 if __name__ == "__main__":
     test_decision_tree()
@@ -1,13 +1,70 @@
-from abc import ABC
+from abc import ABC, abstractmethod
 
 import numpy as np
 
 
 class Model(ABC):
+    @abstractmethod
     def fit(self, X: np.ndarray, y: np.ndarray, *args, **kwargs): ...
 
-    def predict_one(self, X: np.ndarray, *args, **kwargs) -> np.ndarray: ...
+    @abstractmethod
+    def _predict_batch(self, X: np.ndarray) -> np.ndarray: ...
 
-    def predict(self, X_set: np.ndarray, *args, **kwargs) -> np.ndarray:
-        y = np.apply_along_axis(self.predict_one, 1, X_set, *args, **kwargs)
-        return y
+    def _predict_proba_batch(self, X: np.ndarray) -> np.ndarray:
+        raise NotImplementedError(
+            f"{type(self).__name__} does not provide class probabilities"
+        )
+
+    @classmethod
+    def _in_chunks(
+        cls, batch_fn: callable, X_set: np.ndarray, chunk_size: int | None
+    ) -> np.ndarray:
+        X_set = np.asarray(X_set)
+        if chunk_size is None or len(X_set) <= chunk_size:
+            return batch_fn(X_set)
+        if chunk_size <= 0:
+            raise ValueError(f"Invalid chunk size: {chunk_size}")
+
+        return np.concatenate(
+            [
+                batch_fn(X_set[start : start + chunk_size])
+                for start in range(0, len(X_set), chunk_size)
+            ],
+            axis=0,
+        )
+
+    def predict(self, X_set: np.ndarray, chunk_size: int | None = None) -> np.ndarray:
+        return self._in_chunks(self._predict_batch, X_set, chunk_size)
+
+    def predict_proba(
+        self, X_set: np.ndarray, chunk_size: int | None = None
+    ) -> np.ndarray:
+        return self._in_chunks(self._predict_proba_batch, X_set, chunk_size)
+
+    def permutation_importance(
+        self,
+        X: np.ndarray,
+        y: np.ndarray,
+        score: callable = None,
+        seed: int | None = None,
+        chunk_size: int | None = None,
+    ) -> np.ndarray:
+        # score drop on held-out rows when a single column is shuffled,
+        # one batched predict per column on a reused copy of X
+        score = score or (lambda y_true, y_pred: np.mean(y_true == y_pred))
+        X = np.asarray(X)
+        rng = np.random.default_rng(seed)
+
+        baseline = score(y, self.predict(X, chunk_size))
+        importances = np.zeros(X.shape[1])
+        X_permuted = X.copy()
+        for feature_idx in range(X.shape[1]):
+            X_permuted[:, feature_idx] = X[rng.permutation(len(X)), feature_idx]
+            importances[feature_idx] = baseline - score(
+                y, self.predict(X_permuted, chunk_size)
+            )
+            X_permuted[:, feature_idx] = X[:, feature_idx]
+        return importances
+
+    def predict_one(self, X: np.ndarray, *args, **kwargs) -> np.ndarray:
+        return self.predict(np.asarray(X).reshape(1, -1))[0]
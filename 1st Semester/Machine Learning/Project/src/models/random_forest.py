@@ -13,6 +13,7 @@ class RandomForest(Model):
         max_depth: int = np.inf,
         max_features: int | str | None = None,
         criterion: str = "gini",
+        oob_importance: bool = False,
     ):
         if criterion not in ALLOWED_METHODS:
             raise ValueError(f"Invalid method: {criterion}")
@@ -21,13 +22,16 @@ class RandomForest(Model):
         self.max_depth = max_depth
         self.max_features = max_features
         self.method = criterion
+        self.oob_importance = oob_importance
         self.trees = []
+        self.feature_importances_ = None
+        self.oob_importances_ = None
 
     @classmethod
     def _bootstrap_sample(cls, X: np.ndarray, y: np.ndarray):
         n_samples = X.shape[0]
         indices = np.random.choice(n_samples, size=n_samples, replace=True)
-        return X[indices], y[indices]
+        return X[indices], y[indices], indices
 
     def _select_features(self, X: np.ndarray):
         n_features = X.shape[1]
@@ -45,24 +49,67 @@ class RandomForest(Model):
 
     def fit(self, X: np.ndarray, y: np.ndarray, *args, **kwargs):
         self.trees = []
+        self.feature_importances_ = np.zeros(X.shape[1])
+        self.oob_importances_ = np.zeros(X.shape[1]) if self.oob_importance else None
+
         for _ in range(self.n_estimators):
-            X_sample, y_sample = self._bootstrap_sample(X, y)
+            X_sample, y_sample, sample_indices = self._bootstrap_sample(X, y)
             X_sample, feature_indices = self._select_features(X_sample)
 
             tree = DecisionTree(method=self.method, max_depth=self.max_depth)
             tree.fit(X_sample, y_sample)
 
             self.trees.append((tree, feature_indices))
-
-    def predict_one(self, X: np.ndarray, *args, **kwargs):
+            self.feature_importances_[feature_indices] += tree.feature_importances_
+
+            if self.oob_importance:
+                oob_mask = np.ones(len(X), dtype=bool)
+                oob_mask[sample_indices] = False
+                if oob_mask.any():
+                    X_oob = X[oob_mask][:, feature_indices]
+                    self.oob_importances_[
+                        feature_indices
+                    ] += tree.permutation_importance(X_oob, y[oob_mask])
+
+        total_importance = self.feature_importances_.sum()
+        if total_importance > 0:
+            self.feature_importances_ /= total_importance
+        if self.oob_importance:
+            self.oob_importances_ /= len(self.trees)
+
+    def _predict_batch(self, X: np.ndarray) -> np.ndarray:
         tree_predictions = np.array(
             [
-                tree.predict_one(X[feature_indices])
+                tree.predict(X[:, feature_indices])
                 for tree, feature_indices in self.trees
             ]
         )
-        final_prediction = np.bincount(tree_predictions).argmax()  # Majority voting
-        return final_prediction
+        n_classes = max(tree.n_classes for tree, _ in self.trees)
+        votes = np.array(
+            [np.sum(tree_predictions == cls, axis=0) for cls in range(n_classes)]
+        )
+        return votes.argmax(axis=0)  # Majority voting
+
+    def _predict_proba_batch(self, X: np.ndarray) -> np.ndarray:
+        n_classes = max(tree.n_classes for tree, _ in self.trees)
+        proba = np.zeros((len(X), n_classes))
+        for tree, feature_indices in self.trees:
+            # bootstrap samples may miss the highest classes
+            proba[:, : tree.n_classes] += tree.predict_proba(X[:, feature_indices])
+        return proba / len(self.trees)
+
+    def explain(self, X: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        # TreeSHAP is additive, the forest averages the values of its trees
+        n_classes = max(tree.n_classes for tree, _ in self.trees)
+        shap_values = np.zeros((len(X), X.shape[1], n_classes))
+        expected_value = np.zeros(n_classes)
+
+        for tree, feature_indices in self.trees:
+            tree_shap_values, tree_expected_value = tree.explain(X[:, feature_indices])
+            shap_values[:, feature_indices, : tree.n_classes] += tree_shap_values
+            expected_value[: tree.n_classes] += tree_expected_value
+
+        return shap_values / len(self.trees), expected_value / len(self.trees)
 
 
 def test_random_forest():
@@ -71,7 +118,9 @@ def test_random_forest():
 
     print(f"Expected values: {y}")
 
-    rf = RandomForest(n_estimators=6, max_depth=3, max_features="sqrt", method="gini")
+    rf = RandomForest(
+        n_estimators=6, max_depth=3, max_features="sqrt", criterion="gini"
+    )
     rf.fit(X, y)
     predictions = rf.predict(X)
     print(f"Predictions: {predictions}")
@@ -79,6 +128,35 @@ def test_random_forest():
     for idx, tree in enumerate(rf.trees, start=1):
         print(f"{idx}) feats: {tree[1]} - {tree[0].tree}")
 
+    shap_values, expected_value = rf.explain(X)
+    assert np.allclose(expected_value + shap_values.sum(axis=1), rf.predict_proba(X))
+
+
+def test_feature_importances():
+    # only the first of three features decides the label
+    rng = np.random.default_rng(0)
+    X = rng.random((200, 3))
+    y = (X[:, 0] > 0.5).astype(int)
+
+    tree = DecisionTree(max_depth=3)
+    tree.fit(X, y)
+    assert np.isclose(tree.feature_importances_.sum(), 1.0)
+    assert np.argmax(tree.feature_importances_) == 0
+
+    np.random.seed(0)
+    rf = RandomForest(n_estimators=8, max_depth=3, oob_importance=True)
+    rf.fit(X, y)
+    assert np.isclose(rf.feature_importances_.sum(), 1.0)
+    assert np.argmax(rf.feature_importances_) == 0
+    # shuffling the decisive feature costs about half of the accuracy,
+    # shuffling a noise feature costs next to nothing
+    assert rf.oob_importances_[0] > 0.3
+    assert np.all(np.abs(rf.oob_importances_[1:]) < 0.1)
+
+    importances = rf.permutation_importance(X, y, seed=0)
+    assert importances[0] > 0.3 and np.all(np.abs(importances[1:]) < 0.1)
+
 
 if __name__ == "__main__":
     test_random_forest()
+    test_feature_importances()
@@ -29,15 +29,16 @@ class KernelProvider:
     
     
 class Kernels:
+    # kernels accept single vectors as well as row-stacked batches (x: n*d, y: m*d => n*m)
     @staticmethod
     def linear():        
-        return lambda x,y: x @ y        
+        return lambda x,y: x @ y.T
     
     @staticmethod
     def poly(c0): 
         def f(x, y):
-            z = np.atleast_1d(x @ y + c0)
-            return z @ z
+            z = x @ y.T + c0
+            return z * z
         return f
     
 def solve_qp(K, P, C, A, x0):
@@ -146,27 +147,11 @@ class MySVR(Model):
         
         self.coeffs = coeffs
         self.bias = bias
-        self.support_vectors = np.array([x[i] for i in support_vectors_indices])
+        self.support_vectors = x[np.array(support_vectors_indices, dtype=int)]
         
         #print(self.coeffs)
         #print(self.bias)
         #print(self.support_vectors)
     
-    def predict(self, x: np.ndarray, *args, **kwargs) -> np.ndarray: 
-        def coeff_k_prod(x):
-            res = 0
-            for i in range(len(self.coeffs)):
-                res += self.coeffs[i] * self.kp.K_new(self.support_vectors[i], x)
-            return res
-    
-        y = []
-        for i in range(len(x)):            
-            y.append(coeff_k_prod(x[i]) + self.bias)
-            S = 0
-            for j in range(len(self.coeffs)):
-                S += self.coeffs[j] * ((self.support_vectors[j] @ x[i]) ** 2)
-            
-        return np.array(y)
-    
-    def predict_one(self, X: np.ndarray, *args, **kwargs) -> np.ndarray:
-        return self.predict(X.reshape(1, -1))[0]        
\ No newline at end of file
+    def _predict_batch(self, x: np.ndarray) -> np.ndarray:
+        return self.kp.K_new(x, self.support_vectors) @ self.coeffs + self.bias
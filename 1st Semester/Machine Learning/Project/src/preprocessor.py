@@ -1,6 +1,9 @@
-import datetime
+import json
+import os
+import tempfile
 from abc import ABC, abstractmethod
 
+import numpy as np
 import pandas as pd
 
 
@@ -11,6 +14,7 @@ class BaseProcessor(ABC):
 
 
 class DateAndTimePreprocessor(BaseProcessor):
+    VERSION = 1
     _DATE_COLUMN = "Date"
     _TIME_COLUMN = "Time"
     _TARGET_COLUMN = "Room_Occupancy_Count"
@@ -18,34 +22,56 @@ class DateAndTimePreprocessor(BaseProcessor):
 
     @classmethod
     def _drop_unoccupied_dates(cls, df: pd.DataFrame):
-        dates = set(df[cls._DATE_COLUMN])
-        unoccupied_dates = []
-        for date in dates:
-            room_occupancies = set(df[df[cls._DATE_COLUMN] == date][cls._TARGET_COLUMN])
-            if len(room_occupancies) == 1:
-                unoccupied_dates.append(date)
+        room_occupancies = df.groupby(cls._DATE_COLUMN)[cls._TARGET_COLUMN].nunique()
+        unoccupied_dates = room_occupancies.index[room_occupancies == 1]
 
         return df[~df[cls._DATE_COLUMN].isin(unoccupied_dates)]
 
     @classmethod
     def _preprocess_date(cls, date_column: pd.Series):
-        date_mapping = {date: idx + 1 for idx, date in enumerate(date_column.unique())}
-        return date_column.map(date_mapping)
+        # dates are indexed from 1 in order of first appearance
+        codes, _ = pd.factorize(date_column)
+        return pd.Series(codes + 1, index=date_column.index)
 
     @classmethod
-    def _categorize_time(cls, time: datetime.time):
-        for idx, time_division in enumerate(cls._TIMES_DIVISIONS, start=1):
-            if time.hour < time_division:
-                return idx
-        return len(cls._TIMES_DIVISIONS)
+    def _categorize_hours(cls, hours: np.ndarray) -> np.ndarray:
+        # hours past the last division and unparsable times fall in the last bucket
+        categories = np.searchsorted(cls._TIMES_DIVISIONS, hours, side="right") + 1
+        return np.minimum(categories, len(cls._TIMES_DIVISIONS))
 
     @classmethod
-    def _preprocess_time(cls, time_column: pd.Series):
-        time_column = pd.to_datetime(
-            time_column, format="%H:%M:%S", errors="coerce"
-        ).dt.time
+    def _parse_hours(cls, time_column: pd.Series) -> np.ndarray:
+        # fast path: read zero-padded "HH:MM:SS" strings straight from their code points
+        chars = np.frombuffer(
+            time_column.to_numpy(dtype="U9").tobytes(), dtype=np.uint32
+        ).reshape(-1, 9)
+        digits = chars[:, [0, 1, 3, 4, 6, 7]].astype(np.int64) - ord("0")
+        hours, minutes, seconds = (
+            digits[:, 0:2] @ [10, 1],
+            digits[:, 2:4] @ [10, 1],
+            digits[:, 4:6] @ [10, 1],
+        )
+        valid = (
+            (chars[:, 8] == 0)
+            & (chars[:, 2] == ord(":"))
+            & (chars[:, 5] == ord(":"))
+            & np.all((digits >= 0) & (digits <= 9), axis=1)
+            & (hours < 24)
+            & (minutes < 60)
+            & (seconds < 60)
+        )
 
-        return time_column.apply(cls._categorize_time)
+        hours = hours.astype(float)
+        if not valid.all():
+            hours[~valid] = pd.to_datetime(
+                time_column[~valid], format="%H:%M:%S", errors="coerce"
+            ).dt.hour.to_numpy(dtype=float, na_value=np.inf)
+        return hours
+
+    @classmethod
+    def _preprocess_time(cls, time_column: pd.Series):
+        hours = cls._parse_hours(time_column.astype(str))
+        return pd.Series(cls._categorize_hours(hours), index=time_column.index)
 
     @classmethod
     def process(cls, df: pd.DataFrame):
@@ -53,3 +79,185 @@ class DateAndTimePreprocessor(BaseProcessor):
         df[cls._DATE_COLUMN] = cls._preprocess_date(df[cls._DATE_COLUMN])
         df[cls._TIME_COLUMN] = cls._preprocess_time(df[cls._TIME_COLUMN])
         return df
+
+
+class DateAndTimePipeline:
+    VERSION = DateAndTimePreprocessor.VERSION
+    _DATE_COLUMN = DateAndTimePreprocessor._DATE_COLUMN
+    _TIME_COLUMN = DateAndTimePreprocessor._TIME_COLUMN
+    _TARGET_COLUMN = DateAndTimePreprocessor._TARGET_COLUMN
+    # index of the dates that were never seen occupied during fitting
+    UNKNOWN_DATE = 0
+    # the columns fitting reads, and the narrowest dtypes of the output
+    FIT_COLUMNS = [_DATE_COLUMN, _TARGET_COLUMN]
+    DOWNCAST_DTYPES = {_DATE_COLUMN: np.uint16, _TIME_COLUMN: np.uint8}
+
+    def __init__(self):
+        self.date_mapping: dict[str, int] = {}
+        self.occupancies: dict[str, set] = {}
+
+    def fit(self, df: pd.DataFrame) -> "DateAndTimePipeline":
+        return self.fit_chunks([df])
+
+    def fit_chunks(self, chunks) -> "DateAndTimePipeline":
+        # the dates get the indices of a fit on the concatenated chunks
+        self.date_mapping, self.occupancies = {}, {}
+        for chunk in chunks:
+            self._update_occupancies(chunk)
+        self._index_occupied_dates()
+        return self
+
+    def partial_fit(self, df: pd.DataFrame) -> "DateAndTimePipeline":
+        # only the new rows are visited, indices of known dates never change
+        self._update_occupancies(df)
+        self._index_occupied_dates()
+        return self
+
+    def _update_occupancies(self, df: pd.DataFrame):
+        chunk_occupancies = df.groupby(self._DATE_COLUMN, sort=False)[
+            self._TARGET_COLUMN
+        ].unique()
+        for date, values in chunk_occupancies.items():
+            self.occupancies.setdefault(date, set()).update(values.tolist())
+
+    def _index_occupied_dates(self):
+        # in order of first appearance, as DateAndTimePreprocessor.process does
+        for date, occupancies in self.occupancies.items():
+            if len(occupancies) > 1 and date not in self.date_mapping:
+                self.date_mapping[date] = len(self.date_mapping) + 1
+
+    def transform(self, df: pd.DataFrame, drop_unoccupied: bool = True):
+        # serving data has no target, its rows are never dropped
+        if drop_unoccupied and self._TARGET_COLUMN in df.columns:
+            df = df[df[self._DATE_COLUMN].isin(list(self.date_mapping))]
+        df = df.copy()
+
+        df[self._DATE_COLUMN] = (
+            df[self._DATE_COLUMN]
+            .map(self.date_mapping)
+            .fillna(self.UNKNOWN_DATE)
+            .astype(np.int64)
+        )
+        df[self._TIME_COLUMN] = DateAndTimePreprocessor._preprocess_time(
+            df[self._TIME_COLUMN]
+        )
+        return df
+
+    def fit_transform(self, df: pd.DataFrame) -> pd.DataFrame:
+        return self.fit(df).transform(df)
+
+    def save(self, path: str):
+        state = {
+            "version": self.VERSION,
+            "date_mapping": self.date_mapping,
+            "occupancies": {
+                date: sorted(values) for date, values in self.occupancies.items()
+            },
+        }
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "DateAndTimePipeline":
+        with open(path, "r") as f:
+            state = json.load(f)
+        if state["version"] != cls.VERSION:
+            raise ValueError(
+                f"Pipeline version {state['version']} does not match {cls.VERSION}"
+            )
+
+        pipeline = cls()
+        pipeline.date_mapping = state["date_mapping"]
+        pipeline.occupancies = {
+            date: set(values) for date, values in state["occupancies"].items()
+        }
+        return pipeline
+
+
+def make_occupancy_log(n_dates: int = 12, rows_per_date: int = 50, seed: int = 0):
+    # a small log shaped like the Occupancy dataset, every third date unoccupied
+    rng = np.random.default_rng(seed)
+    n_rows = n_dates * rows_per_date
+    occupancies = rng.integers(0, 4, n_rows)
+    occupancies[np.arange(n_rows) // rows_per_date % 3 == 1] = 0
+    return pd.DataFrame(
+        {
+            "Date": np.repeat(
+                [f"2018/01/{day:02d}" for day in range(1, n_dates + 1)], rows_per_date
+            ),
+            "Time": [
+                f"{hour:02d}:{minute:02d}:00"
+                for hour, minute in zip(
+                    rng.integers(0, 24, n_rows), rng.integers(0, 60, n_rows)
+                )
+            ],
+            "S1_Temp": rng.normal(25.0, 1.0, n_rows),
+            "S6_PIR": rng.integers(0, 2, n_rows),
+            "Room_Occupancy_Count": occupancies,
+        }
+    )
+
+
+def test_date_and_time_preprocessor():
+    df = pd.DataFrame(
+        {
+            "Date": ["B", "B", "A", "A", "C", "C", "B", "A", "C", "D"],
+            "Time": [
+                "05:59:59",
+                "9:30:00",
+                "06:00:00",
+                "18:00:00",
+                "14:00:00",
+                "13:59:59",
+                "noon",
+                "23:59:59",
+                "25:00:00",
+                "21:15:00",
+            ],
+            "Room_Occupancy_Count": [0, 1, 3, 3, 0, 0, 2, 3, 1, 1],
+        }
+    )
+    processed = DateAndTimePreprocessor.process(df)
+
+    # A and D never change occupancy, B and C keep their order of appearance
+    assert processed.index.tolist() == [0, 1, 4, 5, 6, 8]
+    assert processed["Date"].tolist() == [1, 1, 2, 2, 1, 2]
+    # unpadded times are parsed, invalid ones fall in the last bucket
+    assert processed["Time"].tolist() == [1, 3, 5, 4, 7, 7]
+
+
+def test_date_and_time_pipeline():
+    df = make_occupancy_log()
+    expected = DateAndTimePreprocessor.process(df.copy())
+
+    pipeline = DateAndTimePipeline().fit(df)
+    assert pipeline.transform(df).equals(expected)
+    chunks = [df.iloc[start : start + 70] for start in range(0, len(df), 70)]
+    assert (
+        DateAndTimePipeline().fit_chunks(chunks).date_mapping == pipeline.date_mapping
+    )
+
+    # fitted incrementally, known dates keep their index
+    incremental = DateAndTimePipeline().fit(df.iloc[:300])
+    known = dict(incremental.date_mapping)
+    incremental.partial_fit(df.iloc[300:])
+    assert all(incremental.date_mapping[date] == idx for date, idx in known.items())
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "pipeline.json")
+        pipeline.save(path)
+        loaded = DateAndTimePipeline.load(path)
+    assert loaded.date_mapping == pipeline.date_mapping
+
+    # serving rows have no target, unknown dates map to UNKNOWN_DATE
+    serving = df.drop(columns="Room_Occupancy_Count").head(3).assign(Date="2019/01/01")
+    transformed = loaded.transform(serving)
+    assert len(transformed) == 3
+    assert (transformed["Date"] == DateAndTimePipeline.UNKNOWN_DATE).all()
+
+
+if __name__ == "__main__":
+    test_date_and_time_preprocessor()
+    test_date_and_time_pipeline()
@@ -0,0 +1,140 @@
+import cProfile
+import json
+import os
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+class PhaseTimer:
+    def __init__(self, trace_memory: bool = False, profiler: cProfile.Profile = None):
+        self.trace_memory = trace_memory
+        self.profiler = profiler
+        self.phases = {}
+        self._started_tracing = False
+
+    def __enter__(self):
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    @contextmanager
+    def phase(self, name: str):
+        # tracemalloc is process-wide: peaks are only meaningful for
+        # sequential runs or process pool workers, not thread pools
+        tracing = self.trace_memory and tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.reset_peak()
+            start_memory = tracemalloc.get_traced_memory()[0]
+        if self.profiler:
+            self.profiler.enable()
+
+        start_time = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            self.phases[f"{name}_ns"] = time.perf_counter_ns() - start_time
+            if self.profiler:
+                self.profiler.disable()
+            if tracing:
+                peak_memory = tracemalloc.get_traced_memory()[1]
+                self.phases[f"{name}_peak_bytes"] = peak_memory - start_memory
+
+
+class RunInstrumentation:
+    trace_memory: bool = False
+    profile_dir: str | None = None
+
+    def on_config_start(self, hp_cfg: dict): ...
+
+    def on_fold_end(self, hp_cfg: dict, k: int, phases: dict): ...
+
+    def on_profile(self, hp_cfg: dict, k: int, profile_path: str): ...
+
+
+class PerformanceRecorder(RunInstrumentation):
+    _SLOWEST_PROFILE_FILE = "slowest_fold.prof"
+    _SLOWEST_RECORD_FILE = "slowest_fold.json"
+    _TIMED_PHASES = ["fit", "predict", "metrics"]
+
+    def __init__(
+        self,
+        log_path: str | None = None,
+        trace_memory: bool = False,
+        profile_dir: str | None = None,
+    ):
+        self.log_path = log_path
+        self.trace_memory = trace_memory
+        self.profile_dir = profile_dir
+        if profile_dir:
+            os.makedirs(profile_dir, exist_ok=True)
+
+        self.records = []
+        self.slowest_record = None
+
+    @classmethod
+    def total_ns(cls, record: dict) -> int:
+        return sum(record.get(f"{phase}_ns", 0) for phase in cls._TIMED_PHASES)
+
+    def on_fold_end(self, hp_cfg: dict, k: int, phases: dict):
+        record = {"config": hp_cfg, "fold": k, **phases}
+        self.records.append(record)
+
+        if self.log_path:
+            with open(self.log_path, "a") as f:
+                f.write(json.dumps(record, default=str) + "\n")
+
+    def on_profile(self, hp_cfg: dict, k: int, profile_path: str):
+        # the slowest fold of a run, profiled again: kept if it is also the
+        # slowest of the runs recorded so far, with its uninstrumented timings
+        record = next(
+            record
+            for record in reversed(self.records)
+            if record["config"] == hp_cfg and record["fold"] == k
+        )
+        if self.slowest_record is not None and self.total_ns(record) <= self.total_ns(
+            self.slowest_record
+        ):
+            os.remove(profile_path)
+            return
+
+        self.slowest_record = record
+        os.replace(
+            profile_path, os.path.join(self.profile_dir, self._SLOWEST_PROFILE_FILE)
+        )
+        with open(os.path.join(self.profile_dir, self._SLOWEST_RECORD_FILE), "w") as f:
+            json.dump(record, f, indent=4, default=str)
+
+    def to_json(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.records, f, indent=4, default=str)
+
+    def to_table(self) -> str:
+        columns = ["config", "fold"] + sorted(
+            {key for record in self.records for key in record} - {"config", "fold"}
+        )
+        rows = [
+            [json.dumps(record["config"], default=str), str(record["fold"])]
+            + [str(record.get(column, "")) for column in columns[2:]]
+            for record in self.records
+        ]
+        widths = [
+            max([len(column)] + [len(row[idx]) for row in rows])
+            for idx, column in enumerate(columns)
+        ]
+
+        lines = [
+            " | ".join(column.ljust(width) for column, width in zip(columns, widths)),
+            "-+-".join("-" * width for width in widths),
+        ]
+        for row in rows:
+            lines.append(
+                " | ".join(value.ljust(width) for value, width in zip(row, widths))
+            )
+        return "\n".join(lines)
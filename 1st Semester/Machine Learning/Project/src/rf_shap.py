@@ -1,17 +1,21 @@
+from concurrent.futures import ProcessPoolExecutor
+
 from sklearn.ensemble import RandomForestClassifier
 
 from src.model_runner import ModelRunner
 from src.models import RandomForest as MyRandomForest, Model
 
 
-if __name__ == "__main__":
-    runner = ModelRunner("dataset/Occupancy_Estimation.csv")
+def pred_caller(rf: Model):
+    # module level, process pool workers have to unpickle it by name
+    def f(x_test):
+        return rf.predict(x_test)
 
-    def pred_caller(rf: Model):
-        def f(x_test):
-            return rf.predict(x_test)
+    return f
 
-        return f
+
+if __name__ == "__main__":
+    runner = ModelRunner("dataset/Occupancy_Estimation.csv")
 
     hp_cfg = {
         "criterion": "gini",
@@ -19,7 +23,14 @@ if __name__ == "__main__":
         "max_depth": 5,
         "max_features": 5,
     }
-    runner.shap(MyRandomForest, hp_cfg, pred_caller=pred_caller)
+    with ProcessPoolExecutor() as executor:
+        runner.shap(
+            MyRandomForest,
+            hp_cfg,
+            pred_caller=pred_caller,
+            executor=executor,
+            values_path="rf_shap_values.npz",
+        )
 
     library_hp_cfg = {
         "criterion": "entropy",
@@ -28,4 +39,11 @@ if __name__ == "__main__":
         "max_features": 5,
     }
 
-    runner.shap(RandomForestClassifier, library_hp_cfg, pred_caller=pred_caller)
+    with ProcessPoolExecutor() as executor:
+        runner.shap(
+            RandomForestClassifier,
+            library_hp_cfg,
+            pred_caller=pred_caller,
+            executor=executor,
+            values_path="sklearn_rf_shap_values.npz",
+        )
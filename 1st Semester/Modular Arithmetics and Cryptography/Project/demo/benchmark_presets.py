@@ -0,0 +1,156 @@
+import time
+
+import numpy as np
+import torch
+
+from src.classifier import MnistClassifier
+from src.ckks import CkksCompatibleMnistClassifier, Encryptor
+from src.ckks.encryptor import PredefinedConfigs
+
+
+def load_held_out_set(n_images: int) -> tuple[torch.Tensor, torch.Tensor | None]:
+    try:
+        from torchvision import datasets, transforms
+    except ImportError:
+        # no labels, the drift is then only measured against the plain model
+        print("torchvision is not installed, benchmarking on random images")
+        return torch.rand(n_images, 1, 28, 28), None
+
+    dataset = datasets.MNIST(
+        root="./datasets", train=False, transform=transforms.ToTensor(), download=True
+    )
+    images, labels = zip(*(dataset[i] for i in range(n_images)))
+    return torch.stack(images), torch.tensor(labels)
+
+
+def benchmark_preset(
+    config: PredefinedConfigs,
+    model: MnistClassifier,
+    images: torch.Tensor,
+    labels: torch.Tensor | None = None,
+) -> dict:
+    """
+    Measures the client and server costs of the single image path (encrypt_image
+    -> forward -> decrypt) with `config`, and the drift of its predictions from
+    the plain `model`. A preset without enough slots or levels for the model
+    is reported as infeasible with the error it raised.
+    """
+    start_time = time.perf_counter()
+    encryptor = Encryptor(config)
+    result = {
+        "keygen_seconds": time.perf_counter() - start_time,
+        "context_bytes": len(encryptor.context_bytes()),
+    }
+    enc_model = CkksCompatibleMnistClassifier(model, encryptor.windows_nb)
+    with torch.no_grad():
+        expected = model(images).numpy()
+
+    latencies = {"encrypt": [], "forward": [], "decrypt": []}
+    outputs = []
+    try:
+        for image in images:
+            start_time = time.perf_counter()
+            enc_image = encryptor.encrypt_image(image)
+            latencies["encrypt"].append(time.perf_counter() - start_time)
+
+            start_time = time.perf_counter()
+            enc_output = enc_model(enc_image)
+            latencies["forward"].append(time.perf_counter() - start_time)
+
+            start_time = time.perf_counter()
+            outputs.append(encryptor.decrypt(enc_output)[:10])
+            latencies["decrypt"].append(time.perf_counter() - start_time)
+    except Exception as e:
+        return {**result, "feasible": False, "error": str(e)}
+
+    outputs = np.array(outputs)
+    result.update(
+        {
+            "feasible": True,
+            "ciphertext_bytes": len(encryptor.data_to_bytes(enc_image)),
+            "response_bytes": len(encryptor.data_to_bytes(enc_output)),
+            **{
+                f"{step}_seconds": float(np.mean(seconds))
+                for step, seconds in latencies.items()
+            },
+            "max_logit_error": float(np.abs(outputs - expected).max()),
+            "agreement": float(
+                np.mean(outputs.argmax(axis=1) == expected.argmax(axis=1))
+            ),
+        }
+    )
+    if labels is not None:
+        labels = labels.numpy()
+        result["plain_accuracy"] = float(np.mean(expected.argmax(axis=1) == labels))
+        result["accuracy"] = float(np.mean(outputs.argmax(axis=1) == labels))
+    return result
+
+
+def benchmark_presets(
+    model: MnistClassifier,
+    images: torch.Tensor,
+    labels: torch.Tensor | None = None,
+) -> dict[str, dict]:
+    return {
+        config.name: benchmark_preset(config, model, images, labels)
+        for config in PredefinedConfigs
+    }
+
+
+def accuracy_drop(result: dict) -> float:
+    if "accuracy" in result:
+        return result["plain_accuracy"] - result["accuracy"]
+    # without labels, every prediction that changed counts as a mistake
+    return 1.0 - result["agreement"]
+
+
+def select_preset(
+    results: dict[str, dict], max_accuracy_drop: float = 0.01
+) -> PredefinedConfigs | None:
+    """
+    Picks the preset with the fastest forward pass among the feasible ones
+    losing at most `max_accuracy_drop` accuracy, None if there is none.
+    """
+    candidates = [
+        (result["forward_seconds"], result["context_bytes"], name)
+        for name, result in results.items()
+        if result["feasible"] and accuracy_drop(result) <= max_accuracy_drop
+    ]
+    if not candidates:
+        return None
+    return PredefinedConfigs[min(candidates)[2]]
+
+
+if __name__ == "__main__":
+    model = MnistClassifier()
+    model.load_state_dict(torch.load("models/mnist_classifier.pth", weights_only=True))
+    model.eval()
+    images, labels = load_held_out_set(n_images=20)
+
+    results = benchmark_presets(model, images, labels)
+    for name, result in results.items():
+        print(f"===== {name} =====")
+        print(
+            f"keygen={result['keygen_seconds']:6.2f}s "
+            f"context={result['context_bytes'] / 1e6:7.2f}MB"
+        )
+        if not result["feasible"]:
+            print(f"infeasible: {result['error']}")
+            continue
+        print(
+            f"ciphertext={result['ciphertext_bytes'] / 1e3:7.1f}KB "
+            f"response={result['response_bytes'] / 1e3:7.1f}KB"
+        )
+        print(
+            f"encrypt={result['encrypt_seconds']:6.3f}s "
+            f"forward={result['forward_seconds']:6.2f}s "
+            f"decrypt={result['decrypt_seconds']:6.3f}s"
+        )
+        print(
+            f"max logit error={result['max_logit_error']:.4f} "
+            f"agreement={result['agreement']:.2%} "
+            f"accuracy drop={accuracy_drop(result):.2%}"
+        )
+
+    preset = select_preset(results, max_accuracy_drop=0.01)
+    print(f"Cheapest preset within 1% accuracy drop: {preset and preset.name}")
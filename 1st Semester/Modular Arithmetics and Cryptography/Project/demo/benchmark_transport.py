@@ -0,0 +1,97 @@
+import time
+
+import torch
+from fastapi.testclient import TestClient
+
+from demo.demo_server import app
+from src.ckks import Encryptor, WireMessage
+from src.ckks.encryptor import PredefinedConfigs
+
+
+def json_round_trip(client: TestClient, encryptor: Encryptor, image: torch.Tensor):
+    context_body = encryptor.serialize()
+    context_id = client.post("/contexts", json=context_body).json()["context_id"]
+
+    start_time = time.perf_counter()
+    request_body = {
+        "context_id": context_id,
+        "image": encryptor.serialize_data(encryptor.encrypt_image(image)),
+    }
+    response = client.post("/inference", json=request_body)
+    response.raise_for_status()
+    encryptor.decrypt(encryptor.deserialize_data(response.json()["preds"]))
+    latency = time.perf_counter() - start_time
+
+    return {
+        "context_bytes": len(context_body["context"]),
+        "request_bytes": len(response.request.content),
+        "response_bytes": len(response.content),
+        "latency": latency,
+    }
+
+
+def binary_round_trip(
+    client: TestClient,
+    encryptor: Encryptor,
+    image: torch.Tensor,
+    compression: str | None,
+):
+    headers = {"Content-Type": WireMessage.MEDIA_TYPE}
+    context_body = WireMessage.encode(
+        {"windows_nb": encryptor.windows_nb},
+        {"context": encryptor.context_bytes()},
+        compression,
+    )
+    context_id = client.post(
+        "/contexts/binary", content=context_body, headers=headers
+    ).json()["context_id"]
+
+    start_time = time.perf_counter()
+    request_body = WireMessage.encode(
+        {"context_id": context_id},
+        {"image": encryptor.data_to_bytes(encryptor.encrypt_image(image))},
+        compression,
+    )
+    response = client.post("/inference/binary", content=request_body, headers=headers)
+    response.raise_for_status()
+    _, sections = WireMessage.decode(response.content)
+    encryptor.decrypt(encryptor.data_from_bytes(sections["preds"]))
+    latency = time.perf_counter() - start_time
+
+    return {
+        "context_bytes": len(context_body),
+        "request_bytes": len(request_body),
+        "response_bytes": len(response.content),
+        "latency": latency,
+    }
+
+
+def benchmark_transport(config: PredefinedConfigs, image: torch.Tensor):
+    client = TestClient(app)
+    encryptor = Encryptor(config)
+
+    results = {"json": json_round_trip(client, encryptor, image)}
+    for compression in WireMessage.COMPRESSIONS:
+        results[f"binary/{compression}"] = binary_round_trip(
+            client, encryptor, image, compression
+        )
+    return results
+
+
+if __name__ == "__main__":
+    image = torch.rand(28, 28)
+    for config in PredefinedConfigs:
+        print(f"===== {config.name} =====")
+        try:
+            results = benchmark_transport(config, image)
+        except Exception as e:
+            print(f"failed: {e}")
+            continue
+
+        for transport, result in results.items():
+            print(
+                f"{transport:>12}: context={result['context_bytes'] / 1e6:8.2f}MB "
+                f"request={result['request_bytes'] / 1e6:6.2f}MB "
+                f"response={result['response_bytes'] / 1e3:7.1f}KB "
+                f"latency={result['latency']:7.2f}s"
+            )
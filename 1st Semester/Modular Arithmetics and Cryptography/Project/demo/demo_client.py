@@ -1,10 +1,9 @@
-import threading
+from concurrent.futures import Future
 
-import requests
 import pygame
 import numpy as np
 
-from src.ckks import Encryptor
+from src.ckks import InferenceClient
 
 
 class DemoClient:
@@ -19,7 +18,10 @@ class DemoClient:
     RESET_BUTTON_COLOR = (255, 100, 100)
     TEXT_COLOR = (255, 255, 255)
     FONT_SIZE = 28
-    URL = "http://localhost:5000/inference"
+    SERVER_URL = "http://localhost:5000"
+    # raw length-prefixed bytes instead of base64 strings inside JSON
+    BINARY_TRANSPORT = True
+    COMPRESSION = None
 
     def __init__(self):
         pygame.init()
@@ -50,9 +52,13 @@ class DemoClient:
         self.probabilities = [0.0] * 10
         self.prediction_text = "Prediction: None"
 
-        # CKKS Encryptor
-        self.encryptor = Encryptor()
-        self.serialized_encryptor = self.encryptor.serialize()
+        # encrypts, talks to the server and decrypts on its own worker thread
+        self.client = InferenceClient(
+            self.SERVER_URL,
+            binary_transport=self.BINARY_TRANSPORT,
+            compression=self.COMPRESSION,
+        )
+        self.prediction = None
 
     def draw_grid(self):
         for y in range(self.GRID_SIZE):
@@ -161,14 +167,15 @@ class DemoClient:
     def set_prediction_text(self, text: str):
         self.prediction_text = f"Prediction: {text}"
 
-    def process_inference_response(self, response: requests.Response):
-        serialized_encrypted_preds = response.json().get("preds", None)
-        if serialized_encrypted_preds is None:
-            self.probabilities = [0.0] * 10
-            self.set_prediction_text("None")
+    def process_prediction(self, prediction: Future):
+        # results of replaced drawings are dropped
+        if prediction is not self.prediction or prediction.cancelled():
+            return
+        if prediction.exception() is not None:
+            print(f"Error: {prediction.exception()}")
+            self.set_prediction_text("Error")
             return
-        encrypted_preds = self.encryptor.deserialize_data(serialized_encrypted_preds)
-        preds = self.encryptor.decrypt(encrypted_preds)
+        preds = prediction.result()
 
         # Perform softmax
         e_preds = np.exp(preds - np.max(preds))
@@ -180,25 +187,8 @@ class DemoClient:
         self.set_prediction_text(f"{predicted_digit} ({confidence:.2f}%)")
 
     def send_inference_request(self):
-        try:
-            encrypted_image = self.encryptor.encrypt_image(self.drawing)
-            serialized_encrypted_image = self.encryptor.serialize_data(encrypted_image)
-
-            request_body = {
-                "encryptor": self.serialized_encryptor,
-                "image": serialized_encrypted_image,
-            }
-
-            response = requests.post(self.URL, json=request_body)
-
-            if response.status_code == 200:
-                self.process_inference_response(response)
-            else:
-                print(f"Invalid response status: {response.status_code}")
-                self.set_prediction_text("Error")
-        except Exception as e:
-            print(f"Error: {e}")
-            self.set_prediction_text("Error")
+        self.prediction = self.client.predict(self.drawing)
+        self.prediction.add_done_callback(self.process_prediction)
 
     def run(self):
         running = True
@@ -229,12 +219,14 @@ class DemoClient:
                     elif event.type == pygame.MOUSEBUTTONDOWN:
                         if self.predict_button_rect.collidepoint(event.pos):
                             self.set_prediction_text("Loading...")
-                            threading.Thread(target=self.send_inference_request).start()
+                            self.send_inference_request()
                         elif self.reset_button_rect.collidepoint(event.pos):
+                            self.prediction = None
                             self.drawing.fill(0.0)
                             self.probabilities = [0.0] * 10
                             self.set_prediction_text("None")
 
+        self.client.close()
         pygame.quit()
 
 
@@ -1,19 +1,31 @@
+import os
 from typing import List
 
-import torch
 import uvicorn
 from pydantic import BaseModel
-from fastapi import FastAPI, HTTPException
-
-from src.ckks import Encryptor, CkksCompatibleMnistClassifier
-from src.classifier import MnistClassifier
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import StreamingResponse
 
+from src.ckks import Encryptor, InferencePool, MicroBatchScheduler, WireMessage
 
 app = FastAPI()
-raw_model = MnistClassifier()
-raw_model.load_state_dict(torch.load("models/mnist_classifier.pth", weights_only=True))
-raw_model.eval()
-ckks_model = CkksCompatibleMnistClassifier(raw_model)
+# every worker process loads the model once and keeps its own contexts
+inference_pool = InferencePool(
+    "models/mnist_classifier.pth",
+    max_workers=int(os.environ.get("INFERENCE_WORKERS", 0)) or None,
+    max_contexts=8,
+    ttl=3600.0,
+    intra_op_threads=int(os.environ.get("INFERENCE_THREADS", 0)),
+)
+# requests of the same context arriving close together share one forward pass,
+# up to MAX_BATCH_SIZE or the batch capacity of the context if it is smaller
+batch_scheduler = MicroBatchScheduler(
+    inference_pool.infer_merged,
+    max_batch_size=int(os.environ.get("MAX_BATCH_SIZE", 8)),
+    max_wait=float(os.environ.get("BATCH_WINDOW_MS", 50)) / 1000,
+)
+# an image for /inference/batched is one ciphertext per element of the 7x7 kernel
+KERNEL_ELEMENTS = 49
 
 
 class InferenceEncryptor(BaseModel):
@@ -21,8 +33,14 @@ class InferenceEncryptor(BaseModel):
     windows_nb: int
 
 
+class ContextResponse(BaseModel):
+    context_id: str
+
+
 class InferenceRequest(BaseModel):
-    encryptor: InferenceEncryptor
+    # either a context registered through /contexts or the full encryptor
+    context_id: str | None = None
+    encryptor: InferenceEncryptor | None = None
     image: str
 
 
@@ -30,26 +48,121 @@ class InferenceResponse(BaseModel):
     preds: str
 
 
-@app.post("/inference", response_model=InferenceResponse)
-async def inference(request: InferenceRequest):
+async def register(context_bytes: bytes, windows_nb: int) -> str:
     try:
-        serialized_encryptor = {
-            "context": request.encryptor.context,
-            "windows_nb": request.encryptor.windows_nb,
-        }
-        encryptor = Encryptor.deserialize(serialized_encryptor)
-        print(f"{encryptor.has_secret_key() = }")
+        return await inference_pool.register(context_bytes, windows_nb)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+async def infer(context_id: str, image_bytes: bytes) -> bytes:
+    try:
+        return await inference_pool.infer(context_id, image_bytes)
+    except KeyError as e:
+        # the client has to register its context again
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-        serialized_image = request.image
-        image = encryptor.deserialize_data(serialized_image)
 
-        preds = ckks_model(image)
-        serialized_preds = encryptor.serialize_data(preds)
+@app.get("/metrics")
+async def metrics():
+    return {**inference_pool.metrics(), "batching": batch_scheduler.metrics()}
 
-        return InferenceResponse(preds=str(serialized_preds))
+
+@app.post("/contexts", response_model=ContextResponse)
+async def register_context(request: InferenceEncryptor):
+    context_id = await register(
+        Encryptor.string_to_bytes(request.context), request.windows_nb
+    )
+    return ContextResponse(context_id=context_id)
+
+
+@app.post("/inference", response_model=InferenceResponse)
+async def inference(request: InferenceRequest):
+    context_id = request.context_id
+    if request.encryptor is not None:
+        context_id = await register(
+            Encryptor.string_to_bytes(request.encryptor.context),
+            request.encryptor.windows_nb,
+        )
+    if context_id is None:
+        raise HTTPException(status_code=400, detail="Missing context_id")
+
+    preds_bytes = await infer(context_id, Encryptor.string_to_bytes(request.image))
+    return InferenceResponse(preds=Encryptor.bytes_to_string(preds_bytes))
+
+
+async def read_message(
+    request: Request, header_types: dict[str, type], section_names: list[str]
+) -> tuple[dict, dict[str, bytes]]:
+    try:
+        header, sections = WireMessage.decode(await request.body())
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid message: {e}")
+
+    for key, key_type in header_types.items():
+        if not isinstance(header.get(key), key_type):
+            raise HTTPException(
+                status_code=400,
+                detail=f"Invalid message: {key} must be of type {key_type.__name__}",
+            )
+    if list(sections) != section_names:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid message: expected the sections {section_names}",
+        )
+    return header, sections
+
+
+@app.post("/contexts/binary", response_model=ContextResponse)
+async def register_context_binary(request: Request):
+    header, sections = await read_message(request, {"windows_nb": int}, ["context"])
+    context_id = await register(sections["context"], header["windows_nb"])
+    return ContextResponse(context_id=context_id)
+
+
+@app.post("/inference/binary")
+async def inference_binary(request: Request):
+    header, sections = await read_message(request, {"context_id": str}, ["image"])
+    preds_bytes = await infer(header["context_id"], sections["image"])
+
+    # answer with the compression the client used
+    return StreamingResponse(
+        WireMessage.iter_encoded({}, {"preds": preds_bytes}, header["compression"]),
+        media_type=WireMessage.MEDIA_TYPE,
+    )
+
+
+@app.post("/inference/batched")
+async def inference_batched(request: Request):
+    # one image encrypted by Encryptor.encrypt_image_replicated, its logits
+    # are at image `slot` of the returned batch
+    window_names = [f"window_{i}" for i in range(KERNEL_ELEMENTS)]
+    header, sections = await read_message(request, {"context_id": str}, window_names)
+    windows_bytes = list(sections.values())
+
+    try:
+        # a context holds a limited number of images per batch
+        batch_capacity = inference_pool.batch_capacity(header["context_id"])
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    try:
+        preds_bytes, slot = await batch_scheduler.submit(
+            header["context_id"], windows_bytes, max_batch_size=batch_capacity
+        )
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+    return StreamingResponse(
+        WireMessage.iter_encoded(
+            {"slot": slot}, {"preds": preds_bytes}, header["compression"]
+        ),
+        media_type=WireMessage.MEDIA_TYPE,
+    )
+
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=5000)
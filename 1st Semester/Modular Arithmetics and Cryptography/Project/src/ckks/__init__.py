@@ -1,7 +1,19 @@
+from .batch_scheduler import MicroBatchScheduler
 from .ckks_classifier import CkksCompatibleMnistClassifier
+from .context_registry import ContextRegistry
 from .encryptor import Encryptor
+from .inference_client import InferenceClient
+from .inference_pool import InferencePool
+from .rotation_keys import RotationKeys
+from .wire import WireMessage
 
 __all__ = [
     "CkksCompatibleMnistClassifier",
+    "ContextRegistry",
     "Encryptor",
+    "InferenceClient",
+    "InferencePool",
+    "MicroBatchScheduler",
+    "RotationKeys",
+    "WireMessage",
 ]
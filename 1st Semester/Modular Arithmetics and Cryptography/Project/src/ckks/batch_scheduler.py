@@ -0,0 +1,77 @@
+import asyncio
+from collections import Counter
+
+
+class MicroBatchScheduler:
+    """
+    Groups the requests submitted under the same key (a context id) within
+    `max_wait` seconds of the first one, up to `max_batch_size` requests, and
+    evaluates them with a single `run_batch(key, items)` coroutine call. Every
+    caller gets the shared result and the position of its item in the batch.
+    A key can have a smaller batch size of its own, e.g. the batch capacity of
+    a context, further requests then go to the next batch.
+    """
+
+    def __init__(
+        self,
+        run_batch: callable,
+        max_batch_size: int = 8,
+        max_wait: float = 0.05,
+    ):
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        # key -> (items, futures, flush timer, batch size) of the batch
+        # being filled
+        self._pending = {}
+        self._running = set()
+        self._batch_sizes = Counter()
+
+    async def submit(
+        self, key, item, max_batch_size: int | None = None
+    ) -> tuple[object, int]:
+        loop = asyncio.get_running_loop()
+        if key not in self._pending:
+            timer = loop.call_later(self.max_wait, self._flush, key)
+            batch_size = min(self.max_batch_size, max_batch_size or self.max_batch_size)
+            self._pending[key] = ([], [], timer, batch_size)
+
+        items, futures, _, batch_size = self._pending[key]
+        future = loop.create_future()
+        items.append(item)
+        futures.append(future)
+        if len(items) >= batch_size:
+            self._flush(key)
+        return await future
+
+    def _flush(self, key):
+        items, futures, timer, _ = self._pending.pop(key)
+        timer.cancel()
+        self._batch_sizes[len(items)] += 1
+
+        task = asyncio.ensure_future(self._run(key, items, futures))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def _run(self, key, items: list, futures: list[asyncio.Future]):
+        try:
+            result = await self.run_batch(key, items)
+        except Exception as e:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        # callers that went away in the meantime have cancelled futures
+        for slot, future in enumerate(futures):
+            if not future.done():
+                future.set_result((result, slot))
+
+    def metrics(self) -> dict:
+        batches = sum(self._batch_sizes.values())
+        requests = sum(size * count for size, count in self._batch_sizes.items())
+        return {
+            "batches": batches,
+            "mean_batch_size": requests / batches if batches else 0.0,
+            "batch_sizes": dict(sorted(self._batch_sizes.items())),
+            "filling": sum(len(items) for items, *_ in self._pending.values()),
+        }
@@ -1,3 +1,8 @@
+import time
+from concurrent.futures import Executor
+from contextlib import contextmanager
+
+import numpy as np
 import torch
 import tenseal as ts
 
@@ -11,32 +16,291 @@ class CkksCompatibleMnistClassifier:
         ).tolist()
         self.conv_bias = model.conv.bias.data.tolist()
 
-        self.fc1_weight = model.fc1.weight.T.data.tolist()
+        # mm takes PlainTensors as they are, lists would be converted per call
+        self.fc1_weight = ts.plain_tensor(model.fc1.weight.T.data.tolist())
         self.fc1_bias = model.fc1.bias.data.tolist()
 
-        self.fc2_weight = model.fc2.weight.T.data.tolist()
+        self.fc2_weight = ts.plain_tensor(model.fc2.weight.T.data.tolist())
         self.fc2_bias = model.fc2.bias.data.tolist()
 
         self.windows_nb = windows_nb
+        self._init_batch_weights(model)
+        # batch size -> operands of forward_batch, see compile
+        self._compiled = {}
+
+    def _init_batch_weights(self, model: MnistClassifier):
+        # batched layout: slot = (channel * padded windows + window) * batch + image
+        self.out_channels = model.conv.out_channels
+        self.padded_windows_nb = self.padded_size(self.windows_nb)
+
+        self.batch_conv_weight = model.conv.weight.data.view(
+            self.out_channels, -1
+        ).numpy()
+        self.batch_conv_bias = model.conv.bias.data.numpy()
+
+        # fc1 rows get the same zero padding as the windows of every channel
+        fc1_weight = model.fc1.weight.data.view(
+            -1, self.out_channels, self.windows_nb
+        ).numpy()
+        self.batch_fc1_weight = np.zeros(
+            (len(fc1_weight), self.out_channels, self.padded_windows_nb)
+        )
+        self.batch_fc1_weight[:, :, : self.windows_nb] = fc1_weight
+        self.batch_fc1_weight = self.batch_fc1_weight.reshape(len(fc1_weight), -1)
+        self.batch_fc1_bias = model.fc1.bias.data.numpy()
+
+        self.batch_fc2_weight = model.fc2.weight.data.numpy()
+        self.batch_fc2_bias = model.fc2.bias.data.numpy()
+
+    @classmethod
+    def padded_size(cls, size: int) -> int:
+        return 1 << (size - 1).bit_length()
+
+    @classmethod
+    def batch_capacity(
+        cls, n_slots: int, out_channels: int = 8, windows_nb: int = 121
+    ) -> int:
+        return n_slots // (out_channels * cls.padded_size(windows_nb))
+
+    @classmethod
+    def rotation_steps(
+        cls,
+        n_slots: int | None = None,
+        windows_nb: int = 121,
+        kernel_size: int = 7,
+        out_channels: int = 8,
+        hidden_dim: int = 64,
+    ) -> list[int]:
+        """
+        The rotations of the encrypted operations for a MnistClassifier with
+        these shapes, so a client only needs these Galois keys. By default
+        those of forward: conv2d_im2col sums the padded kernel elements with
+        rotations of windows_nb * 2^i, and the diagonal method of mm rotates
+        once per input row; pack_vectors only masks. With `n_slots`, those of
+        forward_batch and forward_merged, whose fc1 enc_matmul_plain sums the
+        1024 padded features with rotations of batch size * 2^i.
+
+        With HIGH_DEPTH, the keys of forward only save about 15% of the
+        public context (22 keys and 178 MB instead of 27 keys and 209 MB),
+        as its fc1 rotations decompose into nearly every power of two, and
+        their generation is about twice as slow (~4.8s instead of ~2.4s),
+        since it also pays for saving them. Serializing the context is then
+        faster though (~0.6s instead of ~4s), so a client is still ready a
+        bit sooner overall (~4.6s instead of ~6.4s).
+        Those of forward_batch save about 60% (10 keys, 86 MB).
+        """
+        padded_windows_nb = cls.padded_size(windows_nb)
+        if n_slots is not None:
+            batch_size = cls.batch_capacity(n_slots, out_channels, windows_nb)
+            n_features = out_channels * padded_windows_nb
+            return [batch_size << i for i in range(n_features.bit_length() - 1)]
+
+        kernel_elements = cls.padded_size(kernel_size * kernel_size)
+        conv_steps = [windows_nb << i for i in range(kernel_elements.bit_length() - 1)]
+        fc1_steps = range(1, out_channels * windows_nb)
+        fc2_steps = range(1, hidden_dim)
+        return sorted({*conv_steps, *fc1_steps, *fc2_steps})
+
+    def compile(self, n_slots: int) -> dict:
+        """
+        Prepares the plaintext operands of forward_batch and forward_merged
+        for the batch size that `n_slots` holds: tiled to the slot layout and
+        converted to the float lists TenSEAL takes, so the hot path does no
+        numpy work. They are not encoded into SEAL plaintexts: sealapi's
+        CKKSEncoder could encode them ahead, but CKKSVector operations only
+        take lists and PlainTensors, and a CKKSVector can be neither built
+        from nor updated with sealapi ciphertexts (ciphertext() returns
+        copies). Each operation still encodes its operand at the
+        ciphertext's scale and level, ~2.5 ms per vector with HIGH_DEPTH, or
+        ~0.3s of a forward_batch. As lists only depend on the slot count,
+        they are cached per batch size rather than per context.
+        """
+        batch_size = self.batch_capacity(n_slots, self.out_channels, self.windows_nb)
+        if batch_size not in self._compiled:
+            block_size = self.padded_windows_nb * batch_size
+            conv_weight = [
+                np.repeat(kernel, block_size).tolist()
+                for kernel in self.batch_conv_weight.T
+            ]
+
+            def mask(kernel: list, slot: int) -> list:
+                # zero but at image `slot`, the lists share their floats
+                masked = [0.0] * len(kernel)
+                masked[slot::batch_size] = kernel[slot::batch_size]
+                return masked
+
+            self._compiled[batch_size] = {
+                "conv_weight": conv_weight,
+                # slot -> the kernels of the request at that slot in forward_merged
+                "masked_conv_weight": [
+                    [mask(kernel, slot) for kernel in conv_weight]
+                    for slot in range(batch_size)
+                ],
+                "conv_bias": np.repeat(self.batch_conv_bias, block_size).tolist(),
+                "fc1": [
+                    (weight.tolist(), float(bias))
+                    for weight, bias in zip(self.batch_fc1_weight, self.batch_fc1_bias)
+                ],
+                "fc2": [
+                    (weight.tolist(), float(bias))
+                    for weight, bias in zip(self.batch_fc2_weight, self.batch_fc2_bias)
+                ],
+            }
+        return self._compiled[batch_size]
+
+    @classmethod
+    @contextmanager
+    def _timed(cls, timings: dict | None, layer: str):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            if timings is not None:
+                timings[layer] = time.perf_counter() - start_time
+
+    @classmethod
+    def _map(cls, executor: Executor | None, fn: callable, *iterables) -> list:
+        # TenSEAL releases the GIL inside its operations, threads run them
+        # concurrently on independent ciphertexts
+        if executor is None:
+            return list(map(fn, *iterables))
+        return list(executor.map(fn, *iterables))
 
     @torch.no_grad()
-    def forward(self, enc_x: ts.CKKSVector):
+    def forward(
+        self,
+        enc_x: ts.CKKSVector,
+        executor: Executor | None = None,
+        timings: dict | None = None,
+    ):
+        """
+        With a thread pool `executor`, the channels of the conv layer are
+        convolved concurrently. fc1 stays a single mm: its diagonal method
+        costs one rotation per input row whatever the number of columns, so
+        splitting it in column blocks would multiply the rotations, and
+        TenSEAL already spreads the diagonals over its own threads.
+        `timings` is filled with the latency of every layer in seconds.
+        """
+
+        def convolve(kernel: list, bias: float) -> ts.CKKSVector:
+            return enc_x.conv2d_im2col(kernel, self.windows_nb) + bias
+
         # conv layer
-        enc_channels = []
-        for kernel, bias in zip(self.conv_weight, self.conv_bias):
-            y = enc_x.conv2d_im2col(kernel, self.windows_nb) + bias
-            enc_channels.append(y)
+        with self._timed(timings, "conv"):
+            enc_channels = self._map(
+                executor, convolve, self.conv_weight, self.conv_bias
+            )
         # pack all channels into a single flattened vector
-        enc_x = ts.CKKSVector.pack_vectors(enc_channels)
+        with self._timed(timings, "pack"):
+            enc_x = ts.CKKSVector.pack_vectors(enc_channels)
         # square activation
-        enc_x.square_()
+        with self._timed(timings, "square1"):
+            enc_x.square_()
         # fc1 layer
-        enc_x = enc_x.mm(self.fc1_weight) + self.fc1_bias
+        with self._timed(timings, "fc1"):
+            enc_x = enc_x.mm(self.fc1_weight) + self.fc1_bias
         # square activation
-        enc_x.square_()
+        with self._timed(timings, "square2"):
+            enc_x.square_()
         # fc2 layer
-        enc_x = enc_x.mm(self.fc2_weight) + self.fc2_bias
+        with self._timed(timings, "fc2"):
+            enc_x = enc_x.mm(self.fc2_weight) + self.fc2_bias
         return enc_x
 
+    def forward_batch(
+        self,
+        enc_windows: list[ts.CKKSVector],
+        executor: Executor | None = None,
+        timings: dict | None = None,
+    ) -> ts.CKKSVector:
+        """
+        Evaluates a batch encrypted by `Encryptor.encrypt_image_batch`: one
+        ciphertext per kernel element, holding that element of every window
+        of every image, replicated for each output channel. Every operation,
+        including the rotations of the fc1 products, is shared by the whole
+        batch. Returns the packed logits, slot = class * batch + image.
+        With a thread pool `executor`, the fc1 neurons (the columns of the
+        fc1 matrix) and the fc2 classes are evaluated concurrently.
+        """
+        batch_size = enc_windows[0].size() // (
+            self.out_channels * self.padded_windows_nb
+        )
+        compiled = self.compile(enc_windows[0].size())
+
+        # conv layer, already in the layout of a (batch x 1024) fc1 matrix
+        with self._timed(timings, "conv"):
+            enc_x = enc_windows[0] * compiled["conv_weight"][0]
+            for enc_window, kernel in zip(enc_windows[1:], compiled["conv_weight"][1:]):
+                enc_x += enc_window * kernel
+            enc_x += compiled["conv_bias"]
+        return self._forward_dense_batch(enc_x, batch_size, compiled, executor, timings)
+
+    def forward_merged(
+        self,
+        requests_windows: list[list[ts.CKKSVector]],
+        executor: Executor | None = None,
+        timings: dict | None = None,
+    ) -> ts.CKKSVector:
+        """
+        Evaluates independent requests of the same context as one batch. Every
+        request is encrypted by `Encryptor.encrypt_image_replicated`, with its
+        image in all the batch slots, and request i keeps only slot i: the
+        mask is folded into the plaintext conv weights, so merging costs no
+        extra level. Returns the packed logits of forward_batch, the logits of
+        request i are at image i.
+        """
+        size = requests_windows[0][0].size()
+        batch_size = size // (self.out_channels * self.padded_windows_nb)
+        assert len(requests_windows) <= batch_size, f"At most {batch_size} requests"
+        compiled = self.compile(size)
+
+        with self._timed(timings, "conv"):
+            enc_x = None
+            for enc_windows, conv_weight in zip(
+                requests_windows, compiled["masked_conv_weight"]
+            ):
+                for enc_window, kernel in zip(enc_windows, conv_weight):
+                    y = enc_window * kernel
+                    if enc_x is None:
+                        enc_x = y
+                    else:
+                        enc_x += y
+            enc_x += compiled["conv_bias"]
+        return self._forward_dense_batch(enc_x, batch_size, compiled, executor, timings)
+
+    def _forward_dense_batch(
+        self,
+        enc_x: ts.CKKSVector,
+        batch_size: int,
+        compiled: dict,
+        executor: Executor | None,
+        timings: dict | None,
+    ) -> ts.CKKSVector:
+        # square activation
+        with self._timed(timings, "square1"):
+            enc_x.square_()
+
+        def neuron(weight: list, bias: float) -> ts.CKKSVector:
+            y = enc_x.enc_matmul_plain(weight, batch_size) + bias
+            # square activation
+            y.square_()
+            return y
+
+        # fc1 layer, one encrypted matrix - plain vector product per neuron
+        with self._timed(timings, "fc1"):
+            enc_hidden = self._map(executor, neuron, *zip(*compiled["fc1"]))
+
+        def logit(weight: list, bias: float) -> ts.CKKSVector:
+            y = enc_hidden[0] * weight[0]
+            for enc_h, w in zip(enc_hidden[1:], weight[1:]):
+                y += enc_h * w
+            return y + bias
+
+        # fc2 layer
+        with self._timed(timings, "fc2"):
+            enc_logits = self._map(executor, logit, *zip(*compiled["fc2"]))
+        with self._timed(timings, "pack"):
+            return ts.CKKSVector.pack_vectors(enc_logits)
+
     def __call__(self, *args, **kwargs):
         return self.forward(*args, **kwargs)
@@ -0,0 +1,84 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from .encryptor import Encryptor
+
+
+class ContextRegistry:
+    def __init__(self, max_size: int = 8, ttl: float = 3600.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        # context id -> (loaded context, last access time), oldest first
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def context_id(cls, context_bytes: bytes, windows_nb: int) -> str:
+        digest = hashlib.sha256(context_bytes)
+        digest.update(str(windows_nb).encode("utf-8"))
+        return digest.hexdigest()
+
+    def _load(self, context_id: str, context_bytes: bytes, windows_nb: int):
+        encryptor = Encryptor.from_bytes(context_bytes, windows_nb)
+        if encryptor.has_secret_key():
+            raise ValueError("Refusing to register a context holding a secret key")
+        return encryptor
+
+    def _evict(self, context_id: str, value): ...
+
+    def _evict_expired(self, now: float):
+        while self._entries:
+            context_id, (value, last_access) = next(iter(self._entries.items()))
+            if now - last_access <= self.ttl:
+                break
+            del self._entries[context_id]
+            self._evict(context_id, value)
+
+    def register(self, serialized_encryptor: dict) -> str:
+        return self.register_bytes(
+            Encryptor.string_to_bytes(serialized_encryptor["context"]),
+            serialized_encryptor["windows_nb"],
+        )
+
+    def register_bytes(self, context_bytes: bytes, windows_nb: int) -> str:
+        context_id = self.context_id(context_bytes, windows_nb)
+        with self._lock:
+            if context_id in self._entries:
+                value, _ = self._entries[context_id]
+                self._entries[context_id] = (value, time.time())
+                self._entries.move_to_end(context_id)
+                return context_id
+
+        # load outside the lock, deserializing takes seconds for large contexts
+        value = self._load(context_id, context_bytes, windows_nb)
+
+        with self._lock:
+            self._entries[context_id] = (value, time.time())
+            self._entries.move_to_end(context_id)
+            while len(self._entries) > self.max_size:
+                evicted_id, (evicted, _) = self._entries.popitem(last=False)
+                self._evict(evicted_id, evicted)
+        return context_id
+
+    def get(self, context_id: str) -> Encryptor:
+        now = time.time()
+        with self._lock:
+            self._evict_expired(now)
+            if context_id not in self._entries:
+                raise KeyError(f"Unknown or expired context: {context_id}")
+
+            value, _ = self._entries[context_id]
+            self._entries[context_id] = (value, now)
+            self._entries.move_to_end(context_id)
+            return value
+
+    def __contains__(self, context_id: str) -> bool:
+        with self._lock:
+            self._evict_expired(time.time())
+            return context_id in self._entries
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
@@ -5,6 +5,8 @@ import torch
 import numpy as np
 import tenseal as ts
 
+from .rotation_keys import RotationKeys
+
 
 class PredefinedConfigs(Enum):
     HIGH_DEPTH = {
@@ -34,20 +36,33 @@ class Encryptor:
         config: PredefinedConfigs = None,
         windows_nb: int = 121,
         context: ts.Context | None = None,
+        rotation_steps: list[int] | None = None,
     ):
+        # with `rotation_steps`, only the Galois keys of these rotations are
+        # generated, see CkksCompatibleMnistClassifier.rotation_steps
+        self.galois_keys_bytes = None
         if context:
             self.context = context
         else:
             if config is None:
                 config = PredefinedConfigs.HIGH_DEPTH
 
-            self.context = self.create_ckks_context(**config.value)
+            self.context = self.create_ckks_context(
+                **config.value, generate_galois_keys=rotation_steps is None
+            )
+            if rotation_steps is not None:
+                self.galois_keys_bytes = RotationKeys.generate(
+                    self.context, rotation_steps
+                )
 
         self.windows_nb = windows_nb
 
     @classmethod
     def create_ckks_context(
-        cls, poly_modulus_degree: int, coeff_mod_bit_sizes: list[int]
+        cls,
+        poly_modulus_degree: int,
+        coeff_mod_bit_sizes: list[int],
+        generate_galois_keys: bool = True,
     ):
         assert len(set(coeff_mod_bit_sizes[1:-1])) == 1
         assert coeff_mod_bit_sizes[0] == coeff_mod_bit_sizes[-1]
@@ -60,18 +75,110 @@ class Encryptor:
         )
 
         context.global_scale = pow(2, bits_scale)
-        context.generate_galois_keys()
+        if generate_galois_keys:
+            context.generate_galois_keys()
 
         return context
 
-    def encrypt_image(self, data: np.ndarray | torch.Tensor) -> ts.CKKSVector:
+    def encrypt_image(
+        self, data: np.ndarray | torch.Tensor, enc_zero: ts.CKKSVector | None = None
+    ) -> ts.CKKSVector:
         assert self.has_secret_key()
+        if enc_zero is not None:
+            # only encodes, the encryption was done ahead by encrypt_zero
+            return enc_zero + self.im2col_encoding(data)
+
         data_enc, windows_nb = ts.im2col_encoding(
             self.context, data.squeeze().tolist(), 7, 7, 2
         )
         assert windows_nb == self.windows_nb
         return data_enc
 
+    def im2col_encoding(
+        self, data: np.ndarray | torch.Tensor, kernel_size: int = 7
+    ) -> list[float]:
+        # the slots of ts.im2col_encoding: kernel element major, the kernel
+        # elements zero padded to a power of two
+        windows = self.im2col(np.asarray(data, dtype=np.float64).reshape(1, 28, 28))
+        assert windows.shape[1] == self.windows_nb
+        kernel_elements = kernel_size * kernel_size
+        slots = np.zeros((1 << (kernel_elements - 1).bit_length(), self.windows_nb))
+        slots[:kernel_elements] = windows[0].T
+        return slots.ravel().tolist()
+
+    def encrypt_zero(self, kernel_size: int = 7) -> ts.CKKSVector:
+        """
+        An encryption of zeros shaped as an encrypted image, to be spent on a
+        single encrypt_image call: adding an image only encodes it, the
+        public key encryption can be precomputed while idle. Reusing it for
+        another image would leak the difference of the two images.
+        """
+        assert self.has_secret_key()
+        kernel_elements = 1 << (kernel_size * kernel_size - 1).bit_length()
+        return ts.ckks_vector(self.context, [0.0] * (kernel_elements * self.windows_nb))
+
+    def n_slots(self) -> int:
+        parms = self.context.seal_context().data.first_context_data().parms()
+        return parms.poly_modulus_degree() // 2
+
+    @classmethod
+    def im2col(
+        cls, images: np.ndarray, kernel_size: int = 7, stride: int = 2
+    ) -> np.ndarray:
+        # (n_images, windows, kernel elements), same window order as TenSEAL
+        n_images, height, width = images.shape
+        windows = np.lib.stride_tricks.sliding_window_view(
+            images, (kernel_size, kernel_size), axis=(1, 2)
+        )[:, ::stride, ::stride]
+        return windows.reshape(n_images, -1, kernel_size * kernel_size)
+
+    def batch_capacity(self, out_channels: int = 8) -> int:
+        padded_windows_nb = 1 << (self.windows_nb - 1).bit_length()
+        return self.n_slots() // (out_channels * padded_windows_nb)
+
+    def encrypt_image_batch(
+        self, images: np.ndarray | torch.Tensor, out_channels: int = 8
+    ) -> list[ts.CKKSVector]:
+        """
+        Encrypts up to `batch_capacity()` images for
+        CkksCompatibleMnistClassifier.forward_batch: one ciphertext per
+        kernel element, slot = (channel * padded windows + window) * batch +
+        image. Missing images are zero padded.
+        """
+        assert self.has_secret_key()
+        images = np.asarray(images, dtype=np.float64).reshape(-1, 28, 28)
+        batch_size = self.batch_capacity(out_channels)
+        assert len(images) <= batch_size, f"At most {batch_size} images per batch"
+
+        windows = self.im2col(images)
+        assert windows.shape[1] == self.windows_nb
+        padded_windows_nb = 1 << (self.windows_nb - 1).bit_length()
+
+        # (kernel elements, padded windows, batch)
+        slots = np.zeros((windows.shape[2], padded_windows_nb, batch_size))
+        slots[:, : self.windows_nb, : len(images)] = windows.transpose(2, 1, 0)
+        return [
+            ts.ckks_vector(
+                self.context, np.tile(kernel_slots.ravel(), out_channels).tolist()
+            )
+            for kernel_slots in slots
+        ]
+
+    def encrypt_image_replicated(
+        self, image: np.ndarray | torch.Tensor, out_channels: int = 8
+    ) -> list[ts.CKKSVector]:
+        # the image in every batch slot, the server picks one when merging
+        # the requests of this context in CkksCompatibleMnistClassifier
+        image = np.asarray(image, dtype=np.float64).reshape(1, 28, 28)
+        return self.encrypt_image_batch(
+            np.repeat(image, self.batch_capacity(out_channels), axis=0), out_channels
+        )
+
+    def decrypt_batch(
+        self, enc_logits: ts.CKKSVector, n_images: int, n_classes: int = 10
+    ) -> np.ndarray:
+        return self.decrypt(enc_logits).reshape(n_classes, -1).T[:n_images]
+
     def decrypt(self, enc_data: ts.CKKSVector) -> np.ndarray:
         assert self.has_secret_key()
         data = enc_data.decrypt(self.context.secret_key())
@@ -88,23 +195,38 @@ class Encryptor:
     def string_to_bytes(cls, string_data: str) -> bytes:
         return base64.b64decode(string_data.encode("utf-8"))
 
+    def context_bytes(self) -> bytes:
+        context_bytes = self.context.serialize(save_secret_key=False)
+        if self.galois_keys_bytes is not None:
+            context_bytes = RotationKeys.attach(context_bytes, self.galois_keys_bytes)
+        return context_bytes
+
     def serialize(self) -> dict:
         return {
-            "context": self.bytes_to_string(
-                self.context.serialize(save_secret_key=False)
-            ),
+            "context": self.bytes_to_string(self.context_bytes()),
             "windows_nb": self.windows_nb,
         }
 
+    @classmethod
+    def from_bytes(cls, context_bytes: bytes, windows_nb: int) -> "Encryptor":
+        return Encryptor(context=ts.context_from(context_bytes), windows_nb=windows_nb)
+
     @classmethod
     def deserialize(cls, serialized_encryptor: dict) -> "Encryptor":
-        context = ts.context_from(cls.string_to_bytes(serialized_encryptor["context"]))
-        windows_nb = serialized_encryptor["windows_nb"]
-        return Encryptor(context=context, windows_nb=windows_nb)
+        return cls.from_bytes(
+            cls.string_to_bytes(serialized_encryptor["context"]),
+            serialized_encryptor["windows_nb"],
+        )
 
-    def serialize_data(self, vec: ts.CKKSVector) -> str:
+    def data_to_bytes(self, vec: ts.CKKSVector) -> bytes:
         vec.link_context(self.context)
-        return self.bytes_to_string(vec.serialize())
+        return vec.serialize()
+
+    def data_from_bytes(self, vec_bytes: bytes) -> ts.CKKSVector:
+        return ts.ckks_vector_from(self.context, vec_bytes)
+
+    def serialize_data(self, vec: ts.CKKSVector) -> str:
+        return self.bytes_to_string(self.data_to_bytes(vec))
 
     def deserialize_data(self, serialized_vec: str) -> ts.CKKSVector:
-        return ts.ckks_vector_from(self.context, self.string_to_bytes(serialized_vec))
+        return self.data_from_bytes(self.string_to_bytes(serialized_vec))
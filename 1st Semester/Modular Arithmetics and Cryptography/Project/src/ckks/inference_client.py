@@ -0,0 +1,226 @@
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import numpy as np
+import requests
+import torch
+from requests.adapters import HTTPAdapter
+
+from .ckks_classifier import CkksCompatibleMnistClassifier
+from .encryptor import Encryptor
+from .wire import WireMessage
+
+
+class InferenceClient:
+    """
+    Client side of the inference server, without any UI. The requests run on
+    a single worker thread, which owns the TenSEAL context and a keep-alive
+    HTTP session: `predict` queues an image and returns a Future of its
+    logits, cancelling the predictions still queued behind the one in
+    flight. While idle, the worker registers the context and precomputes
+    encryptions of zero (see Encryptor.encrypt_zero), so a prediction only
+    pays for encoding the image and the server's forward pass.
+    """
+
+    def __init__(
+        self,
+        server_url: str = "http://localhost:5000",
+        encryptor: Encryptor | None = None,
+        binary_transport: bool = True,
+        compression: str | None = None,
+        precomputed_zeros: int = 2,
+        idle_interval: float = 0.5,
+        session: requests.Session | None = None,
+    ):
+        self.server_url = server_url
+        # only the Galois keys the server's forward uses
+        self.encryptor = encryptor or Encryptor(
+            rotation_steps=CkksCompatibleMnistClassifier.rotation_steps()
+        )
+        self.binary_transport = binary_transport
+        self.compression = compression
+        self.precomputed_zeros = precomputed_zeros
+        self.idle_interval = idle_interval
+        self.session = session or self.create_session()
+        self.context_id = None
+
+        self._enc_zeros = deque()
+        self._jobs = queue.Queue()
+        self._lock = threading.Lock()
+        # the prediction waiting for the worker, replaced by a newer one
+        self._queued = None
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    @classmethod
+    def create_session(cls, pool_size: int = 2) -> requests.Session:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def predict(self, image: np.ndarray | torch.Tensor) -> Future:
+        future = Future()
+        with self._lock:
+            if self._queued is not None:
+                # stale, the image changed before it was even sent
+                self._queued.cancel()
+            self._queued = future
+        self._jobs.put((future, self.infer, (np.array(image, dtype=np.float64),)))
+        return future
+
+    def precompute(self) -> Future:
+        # what the idle worker would do, right away
+        future = Future()
+        self._jobs.put((future, self._precompute, ()))
+        return future
+
+    def _run(self):
+        while True:
+            try:
+                job = self._jobs.get(timeout=self.idle_interval)
+            except queue.Empty:
+                try:
+                    self._precompute_step()
+                except Exception as e:
+                    # the worker keeps running, what was queued meanwhile
+                    # fails instead of waiting forever
+                    self._fail_queued(e)
+                continue
+            if job is None:
+                return
+
+            future, fn, args = job
+            with self._lock:
+                if self._queued is future:
+                    self._queued = None
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(*args))
+            except Exception as e:
+                future.set_exception(e)
+
+    def _fail_queued(self, error: Exception):
+        stop = False
+        while True:
+            try:
+                job = self._jobs.get_nowait()
+            except queue.Empty:
+                break
+            if job is None:
+                stop = True
+                continue
+            future, _, _ = job
+            with self._lock:
+                if self._queued is future:
+                    self._queued = None
+            if future.set_running_or_notify_cancel():
+                future.set_exception(error)
+        if stop:
+            self._jobs.put(None)
+
+    def _precompute_step(self) -> bool:
+        try:
+            if self.context_id is None:
+                self.register_context()
+                return True
+        except requests.RequestException:
+            # the server is not up yet, retried on the next idle interval
+            pass
+        if len(self._enc_zeros) < self.precomputed_zeros:
+            self._enc_zeros.append(self.encryptor.encrypt_zero())
+            return True
+        return False
+
+    def _precompute(self):
+        while self._precompute_step():
+            pass
+
+    def register_context(self):
+        if self.binary_transport:
+            response = self.session.post(
+                f"{self.server_url}/contexts/binary",
+                data=WireMessage.encode(
+                    {"windows_nb": self.encryptor.windows_nb},
+                    {"context": self.encryptor.context_bytes()},
+                    self.compression,
+                ),
+                headers={"Content-Type": WireMessage.MEDIA_TYPE},
+            )
+        else:
+            response = self.session.post(
+                f"{self.server_url}/contexts", json=self.encryptor.serialize()
+            )
+        response.raise_for_status()
+        self.context_id = response.json()["context_id"]
+
+    def post_encrypted_image(self, encrypted_image) -> requests.Response:
+        if self.binary_transport:
+            return self.session.post(
+                f"{self.server_url}/inference/binary",
+                data=WireMessage.encode(
+                    {"context_id": self.context_id},
+                    {"image": self.encryptor.data_to_bytes(encrypted_image)},
+                    self.compression,
+                ),
+                headers={"Content-Type": WireMessage.MEDIA_TYPE},
+            )
+
+        request_body = {
+            "context_id": self.context_id,
+            "image": self.encryptor.serialize_data(encrypted_image),
+        }
+        return self.session.post(f"{self.server_url}/inference", json=request_body)
+
+    def read_preds(self, response: requests.Response) -> np.ndarray:
+        if self.binary_transport:
+            _, sections = WireMessage.decode(response.content)
+            encrypted_preds = self.encryptor.data_from_bytes(sections["preds"])
+        else:
+            encrypted_preds = self.encryptor.deserialize_data(response.json()["preds"])
+        return self.encryptor.decrypt(encrypted_preds)
+
+    def infer(self, image: np.ndarray | torch.Tensor) -> np.ndarray:
+        # synchronous, for the worker or a caller managing its own threads
+        enc_zero = self._enc_zeros.popleft() if self._enc_zeros else None
+        encrypted_image = self.encryptor.encrypt_image(image, enc_zero)
+
+        # the public context is uploaded once, then referenced by its id
+        if self.context_id is None:
+            self.register_context()
+
+        response = self.post_encrypted_image(encrypted_image)
+        if response.status_code == 404:
+            # evicted from the server's registry
+            self.register_context()
+            response = self.post_encrypted_image(encrypted_image)
+        response.raise_for_status()
+        return self.read_preds(response)
+
+    def close(self):
+        with self._lock:
+            if self._queued is not None:
+                self._queued.cancel()
+        self._jobs.put(None)
+        self._worker.join()
+        self.session.close()
+
+
+if __name__ == "__main__":
+    # headless run against a server started with demo/demo_server.py
+    client = InferenceClient()
+    client.precompute().result()
+
+    images = np.random.rand(3, 28, 28) * (np.random.rand(3, 28, 28) < 0.2)
+    start_time = time.perf_counter()
+    futures = [client.predict(image) for image in images]
+    print(f"Prediction: {futures[-1].result().argmax()}")
+    print(f"Latency: {time.perf_counter() - start_time:.2f}s")
+    # replaced by the next image before the worker took them
+    print(f"Cancelled: {[future.cancelled() for future in futures]}")
+    client.close()
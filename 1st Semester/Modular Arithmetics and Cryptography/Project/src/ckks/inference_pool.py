@@ -0,0 +1,264 @@
+import asyncio
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import torch
+
+from src.classifier import MnistClassifier
+from .ckks_classifier import CkksCompatibleMnistClassifier
+from .context_registry import ContextRegistry
+from .encryptor import Encryptor
+from .wire import WireMessage
+
+
+class SpooledContextRegistry(ContextRegistry):
+    """
+    Main process side of the pool: registered contexts are only written to a
+    spool directory shared with the workers, which deserialize them lazily.
+    """
+
+    def __init__(
+        self,
+        spool_dir: str,
+        max_size: int = 8,
+        ttl: float = 3600.0,
+        on_evict: callable = None,
+    ):
+        super().__init__(max_size=max_size, ttl=ttl)
+        self.spool_dir = spool_dir
+        self.on_evict = on_evict
+
+    @classmethod
+    def spool_path(cls, spool_dir: str, context_id: str) -> str:
+        return os.path.join(spool_dir, f"{context_id}.ctx")
+
+    def _load(self, context_id: str, context_bytes: bytes, windows_nb: int) -> str:
+        path = self.spool_path(self.spool_dir, context_id)
+        # concurrent registrations of the same context each write their own
+        # file, the last replace wins with identical contents
+        fd, tmp_path = tempfile.mkstemp(dir=self.spool_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in WireMessage.iter_encoded(
+                    {"windows_nb": windows_nb}, {"context": context_bytes}
+                ):
+                    f.write(chunk)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return path
+
+    def _evict(self, context_id: str, path: str):
+        if os.path.exists(path):
+            os.remove(path)
+        if self.on_evict:
+            self.on_evict(context_id)
+
+    def discard(self, context_id: str):
+        with self._lock:
+            path, _ = self._entries.pop(context_id, (None, None))
+        if path:
+            self._evict(context_id, path)
+
+
+# per worker process state, set up once by _init_worker
+_worker_model = None
+_worker_registry = None
+_worker_spool_dir = None
+_worker_threads = None
+
+
+def _init_worker(
+    model_path: str,
+    spool_dir: str,
+    max_contexts: int,
+    ttl: float,
+    intra_op_threads: int,
+):
+    global _worker_model, _worker_registry, _worker_spool_dir, _worker_threads
+
+    raw_model = MnistClassifier()
+    raw_model.load_state_dict(torch.load(model_path, weights_only=True))
+    raw_model.eval()
+    _worker_model = CkksCompatibleMnistClassifier(raw_model)
+    _worker_registry = ContextRegistry(max_size=max_contexts, ttl=ttl)
+    _worker_spool_dir = spool_dir
+    if intra_op_threads > 1:
+        _worker_threads = ThreadPoolExecutor(max_workers=intra_op_threads)
+
+
+def _worker_encryptor(context_id: str) -> Encryptor:
+    try:
+        return _worker_registry.get(context_id)
+    except KeyError:
+        pass
+
+    path = SpooledContextRegistry.spool_path(_worker_spool_dir, context_id)
+    try:
+        with open(path, "rb") as f:
+            header, sections = WireMessage.decode(f.read())
+    except FileNotFoundError:
+        raise KeyError(f"Unknown or expired context: {context_id}")
+
+    _worker_registry.register_bytes(sections["context"], header["windows_nb"])
+    encryptor = _worker_registry.get(context_id)
+    _worker_model.compile(encryptor.n_slots())
+    return encryptor
+
+
+def _preload_context(context_id: str) -> int:
+    return _worker_encryptor(context_id).n_slots()
+
+
+def _run_inference(context_id: str, image_bytes: bytes) -> tuple[bytes, dict]:
+    encryptor = _worker_encryptor(context_id)
+    image = encryptor.data_from_bytes(image_bytes)
+    timings = {}
+    preds = _worker_model(image, executor=_worker_threads, timings=timings)
+    return encryptor.data_to_bytes(preds), timings
+
+
+def _run_merged_inference(
+    context_id: str, requests_windows_bytes: list[list[bytes]]
+) -> tuple[bytes, dict]:
+    encryptor = _worker_encryptor(context_id)
+    requests_windows = [
+        [encryptor.data_from_bytes(window_bytes) for window_bytes in windows_bytes]
+        for windows_bytes in requests_windows_bytes
+    ]
+    timings = {}
+    preds = _worker_model.forward_merged(
+        requests_windows, executor=_worker_threads, timings=timings
+    )
+    return encryptor.data_to_bytes(preds), timings
+
+
+class InferencePool:
+    def __init__(
+        self,
+        model_path: str,
+        max_workers: int | None = None,
+        spool_dir: str | None = None,
+        max_contexts: int = 8,
+        ttl: float = 3600.0,
+        intra_op_threads: int = 0,
+    ):
+        self.max_workers = max_workers or os.cpu_count()
+        self._spool = None
+        if spool_dir is None:
+            self._spool = tempfile.TemporaryDirectory(prefix="ckks_contexts_")
+            spool_dir = self._spool.name
+        os.makedirs(spool_dir, exist_ok=True)
+
+        # context id -> slot count, reported by the worker validating it
+        self._n_slots = {}
+        self.registry = SpooledContextRegistry(
+            spool_dir,
+            max_contexts,
+            ttl,
+            on_evict=lambda context_id: self._n_slots.pop(context_id, None),
+        )
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            initializer=_init_worker,
+            initargs=(model_path, spool_dir, max_contexts, ttl, intra_op_threads),
+        )
+
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._completed = 0
+        self._failed = 0
+        # layer -> total seconds over the completed inferences
+        self._layer_seconds = {}
+        self._timed_inferences = 0
+
+    async def _submit(self, fn: callable, *args):
+        with self._lock:
+            self._pending += 1
+        try:
+            result = await asyncio.wrap_future(self.executor.submit(fn, *args))
+        except Exception:
+            with self._lock:
+                self._failed += 1
+            raise
+        finally:
+            with self._lock:
+                self._pending -= 1
+        with self._lock:
+            self._completed += 1
+        return result
+
+    async def register(self, context_bytes: bytes, windows_nb: int) -> str:
+        # hashing and spooling tens of MB, keep it off the event loop
+        context_id = await asyncio.to_thread(
+            self.registry.register_bytes, context_bytes, windows_nb
+        )
+        try:
+            # validates the context and warms up one of the workers
+            self._n_slots[context_id] = await self._submit(_preload_context, context_id)
+        except Exception:
+            self.registry.discard(context_id)
+            raise
+        return context_id
+
+    async def infer(self, context_id: str, image_bytes: bytes) -> bytes:
+        # refreshes the spooled context, raises KeyError once it expired
+        self.registry.get(context_id)
+        preds_bytes, timings = await self._submit(
+            _run_inference, context_id, image_bytes
+        )
+        self._record_timings(timings)
+        return preds_bytes
+
+    def batch_capacity(self, context_id: str) -> int:
+        # how many requests infer_merged can evaluate together for a context
+        self.registry.get(context_id)
+        return CkksCompatibleMnistClassifier.batch_capacity(self._n_slots[context_id])
+
+    async def infer_merged(
+        self, context_id: str, requests_windows_bytes: list[list[bytes]]
+    ) -> bytes:
+        """
+        Evaluates requests encrypted by `Encryptor.encrypt_image_replicated`
+        as one batch, the logits of request i are at image i of the result.
+        """
+        self.registry.get(context_id)
+        preds_bytes, timings = await self._submit(
+            _run_merged_inference, context_id, requests_windows_bytes
+        )
+        self._record_timings(timings)
+        return preds_bytes
+
+    def _record_timings(self, timings: dict):
+        with self._lock:
+            self._timed_inferences += 1
+            for layer, seconds in timings.items():
+                self._layer_seconds[layer] = (
+                    self._layer_seconds.get(layer, 0.0) + seconds
+                )
+
+    def metrics(self) -> dict:
+        with self._lock:
+            # the executor runs the tasks in submission order
+            in_flight = min(self._pending, self.max_workers)
+            return {
+                "workers": self.max_workers,
+                "queue_depth": self._pending - in_flight,
+                "in_flight": in_flight,
+                "completed": self._completed,
+                "failed": self._failed,
+                "contexts": len(self.registry),
+                "mean_layer_seconds": {
+                    layer: seconds / self._timed_inferences
+                    for layer, seconds in self._layer_seconds.items()
+                },
+            }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        if self._spool:
+            self._spool.cleanup()
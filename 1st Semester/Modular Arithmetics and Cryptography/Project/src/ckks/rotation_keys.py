@@ -0,0 +1,118 @@
+import os
+import tempfile
+
+import tenseal as ts
+import tenseal.sealapi as sealapi
+
+
+class RotationKeys:
+    """
+    Galois keys restricted to the rotations a model performs. TenSEAL only
+    generates the keys of every power-of-two rotation, so the keys are made
+    with SEAL directly and spliced into the public context message:
+    TenSEALContextProto.public_context (field 2) gets them as its galois_keys
+    (field 5). A context holding its secret key ignores these keys when it is
+    loaded, they only reach the (public) evaluating side.
+    """
+
+    PUBLIC_CONTEXT_FIELD = 2
+    GALOIS_KEYS_FIELD = 5
+    LENGTH_DELIMITED = 2
+
+    @classmethod
+    def naf(cls, step: int) -> list[int]:
+        # the power-of-two rotations SEAL composes a rotation without its own
+        # key from, the non-adjacent form of the step
+        components = []
+        sign = -1 if step < 0 else 1
+        step = abs(step)
+        i = 0
+        while step:
+            digit = 2 - (step & 3) if step & 1 else 0
+            step = (step - digit) >> 1
+            if digit:
+                components.append(sign * digit * (1 << i))
+            i += 1
+        return components
+
+    @classmethod
+    def key_steps(cls, rotation_steps) -> list[int]:
+        # a key per step, unless the power-of-two keys they decompose into
+        # are fewer (e.g. the one rotation per row of the diagonal matmul)
+        rotation_steps = {step for step in rotation_steps if step}
+        naf_steps = {c for step in rotation_steps for c in cls.naf(step)}
+        return sorted(min(rotation_steps, naf_steps, key=len))
+
+    @classmethod
+    def generate(cls, context: ts.Context, rotation_steps) -> bytes:
+        assert context.has_secret_key()
+        seal_context = context.seal_context().data
+        # passing the Galois elements, a list of positive steps would be taken
+        # for elements by the first create_galois_keys overload
+        galois_elements = (
+            seal_context.key_context_data()
+            .galois_tool()
+            .get_elts_from_steps(cls.key_steps(rotation_steps))
+        )
+        keygen = sealapi.KeyGenerator(seal_context, context.secret_key().data)
+        galois_keys = sealapi.GaloisKeys()
+        keygen.create_galois_keys(galois_elements, galois_keys)
+
+        # SEAL objects are only saved to files through sealapi
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "galois_keys")
+            galois_keys.save(path)
+            with open(path, "rb") as f:
+                return f.read()
+
+    @classmethod
+    def _read_varint(cls, data: bytes, offset: int) -> tuple[int, int]:
+        value = shift = 0
+        while True:
+            byte = data[offset]
+            offset += 1
+            value |= (byte & 0x7F) << shift
+            shift += 7
+            if byte < 0x80:
+                return value, offset
+
+    @classmethod
+    def _varint(cls, value: int) -> bytes:
+        encoded = bytearray()
+        while value > 0x7F:
+            encoded.append(value & 0x7F | 0x80)
+            value >>= 7
+        encoded.append(value)
+        return bytes(encoded)
+
+    @classmethod
+    def _length_delimited(cls, field: int, payload: bytes) -> bytes:
+        tag = field << 3 | cls.LENGTH_DELIMITED
+        return cls._varint(tag) + cls._varint(len(payload)) + payload
+
+    @classmethod
+    def attach(cls, context_bytes: bytes, galois_keys_bytes: bytes) -> bytes:
+        """
+        Adds `galois_keys_bytes` to a context serialized without Galois keys.
+        """
+        fields = []
+        offset = 0
+        while offset < len(context_bytes):
+            start = offset
+            tag, offset = cls._read_varint(context_bytes, offset)
+            if tag & 7 == 0:
+                _, offset = cls._read_varint(context_bytes, offset)
+            elif tag & 7 == cls.LENGTH_DELIMITED:
+                length, offset = cls._read_varint(context_bytes, offset)
+                payload = context_bytes[offset : offset + length]
+                offset += length
+                if tag >> 3 == cls.PUBLIC_CONTEXT_FIELD:
+                    payload += cls._length_delimited(
+                        cls.GALOIS_KEYS_FIELD, galois_keys_bytes
+                    )
+                    fields.append(cls._length_delimited(tag >> 3, payload))
+                    continue
+            else:
+                raise ValueError(f"Unexpected wire type in context: {tag & 7}")
+            fields.append(context_bytes[start:offset])
+        return b"".join(fields)
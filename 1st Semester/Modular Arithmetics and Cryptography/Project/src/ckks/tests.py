@@ -1,9 +1,22 @@
+import asyncio
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import tenseal as ts
 import tqdm
 import torch
 
 from src.classifier import MnistClassifier
+from src.ckks.batch_scheduler import MicroBatchScheduler
 from src.ckks.ckks_classifier import CkksCompatibleMnistClassifier
+from src.ckks.context_registry import ContextRegistry
 from src.ckks.encryptor import Encryptor
+from src.ckks.inference_client import InferenceClient
+from src.ckks.inference_pool import SpooledContextRegistry
+from src.ckks.wire import WireMessage
 
 
 def test_ckks_classifier(encryptor: Encryptor):
@@ -19,6 +32,100 @@ def test_ckks_classifier(encryptor: Encryptor):
         assert output.shape == (10,)
 
 
+def test_ckks_classifier_batch(encryptor: Encryptor):
+    classifier = MnistClassifier()
+    classifier.eval()
+    enc_classifier = CkksCompatibleMnistClassifier(classifier, windows_nb=121)
+
+    batch_example = torch.randint(0, 255, (3, 1, 28, 28)) / 255.0
+    with torch.no_grad():
+        expected = classifier(batch_example).numpy()
+
+    enc_windows = encryptor.encrypt_image_batch(batch_example)
+    output = encryptor.decrypt_batch(enc_classifier.forward_batch(enc_windows), 3)
+    assert output.shape == (3, 10)
+    assert abs(output - expected).max() < 1e-1
+
+
+def test_ckks_classifier_merged(encryptor: Encryptor):
+    classifier = MnistClassifier()
+    classifier.eval()
+    enc_classifier = CkksCompatibleMnistClassifier(classifier, windows_nb=121)
+
+    batch_example = torch.randint(0, 255, (3, 1, 28, 28)) / 255.0
+    with torch.no_grad():
+        expected = classifier(batch_example).numpy()
+
+    requests_windows = [
+        encryptor.encrypt_image_replicated(image) for image in batch_example
+    ]
+    enc_output = enc_classifier.forward_merged(requests_windows)
+    output = encryptor.decrypt_batch(enc_output, 3)
+    assert abs(output - expected).max() < 1e-1
+
+
+def test_rotation_keys():
+    classifier = MnistClassifier()
+    classifier.eval()
+    enc_classifier = CkksCompatibleMnistClassifier(classifier, windows_nb=121)
+
+    encryptor = Encryptor(rotation_steps=enc_classifier.rotation_steps(8192))
+    server_encryptor = Encryptor.from_bytes(encryptor.context_bytes(), 121)
+    assert server_encryptor.context.has_galois_keys()
+
+    batch_example = torch.randint(0, 255, (2, 1, 28, 28)) / 255.0
+    with torch.no_grad():
+        expected = classifier(batch_example).numpy()
+
+    enc_windows = [
+        server_encryptor.data_from_bytes(encryptor.data_to_bytes(enc_window))
+        for enc_window in encryptor.encrypt_image_batch(batch_example)
+    ]
+    enc_output = enc_classifier.forward_batch(enc_windows)
+    output = encryptor.decrypt_batch(enc_output, 2)
+    assert abs(output - expected).max() < 1e-1
+
+
+def test_rotation_keys_forward(encryptor: Encryptor):
+    classifier = MnistClassifier()
+    classifier.eval()
+    enc_classifier = CkksCompatibleMnistClassifier(classifier, windows_nb=121)
+
+    # compared with forward under the default keys of `encryptor`, the single
+    # image path drifts further than 1e-1 from the plain model on random images
+    client_encryptor = Encryptor(rotation_steps=enc_classifier.rotation_steps())
+    server_encryptor = Encryptor.from_bytes(client_encryptor.context_bytes(), 121)
+    assert server_encryptor.context.has_galois_keys()
+
+    input_example = torch.randint(0, 255, (1, 28, 28)) / 255.0
+    enc_image = server_encryptor.data_from_bytes(
+        client_encryptor.data_to_bytes(client_encryptor.encrypt_image(input_example))
+    )
+    output = client_encryptor.decrypt(enc_classifier(enc_image))
+    expected = encryptor.decrypt(enc_classifier(encryptor.encrypt_image(input_example)))
+    assert output.shape == (10,)
+    assert abs(output - expected).max() < 1e-2
+
+
+def test_micro_batch_scheduler():
+    batches = []
+
+    async def run_batch(key, items):
+        batches.append(list(items))
+        return key
+
+    async def submit_all():
+        scheduler = MicroBatchScheduler(run_batch, max_batch_size=8, max_wait=0.01)
+        # more requests than the batch capacity of the context
+        return await asyncio.gather(
+            *[scheduler.submit("context", i, max_batch_size=2) for i in range(5)]
+        )
+
+    results = asyncio.run(submit_all())
+    assert batches == [[0, 1], [2, 3], [4]]
+    assert [slot for _, slot in results] == [0, 1, 0, 1, 0]
+
+
 def test_encoder_serializer(encryptor: Encryptor):
     random_img = torch.rand(28, 28)
     enc_img = encryptor.encrypt_image(random_img)
@@ -37,9 +144,127 @@ def test_encoder_serializer(encryptor: Encryptor):
     )
 
 
+def test_context_registry(encryptor: Encryptor):
+    serialized_encryptor = encryptor.serialize()
+    registry = ContextRegistry(max_size=1, ttl=60.0)
+
+    context_id = registry.register(serialized_encryptor)
+    assert registry.register(serialized_encryptor) == context_id
+    assert registry.get(context_id).has_secret_key() is False
+
+    registry.register({**serialized_encryptor, "windows_nb": 0})
+    assert context_id not in registry and len(registry) == 1
+
+
+def test_spooled_context_registry():
+    evicted = []
+    with tempfile.TemporaryDirectory() as spool_dir:
+        registry = SpooledContextRegistry(
+            spool_dir, max_size=1, on_evict=evicted.append
+        )
+        # the same context uploaded concurrently, spooling is not locked
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            context_ids = list(
+                executor.map(
+                    lambda _: registry.register_bytes(b"context", 121), range(3)
+                )
+            )
+        assert len(set(context_ids)) == 1
+        assert os.listdir(spool_dir) == [f"{context_ids[0]}.ctx"]
+
+        registry.register_bytes(b"other context", 121)
+        assert evicted == context_ids[:1] and len(os.listdir(spool_dir)) == 1
+
+
+def test_wire_message():
+    sections = {"context": b"\x00" * 1000, "image": bytes(range(256))}
+    for compression in WireMessage.COMPRESSIONS:
+        message = WireMessage.encode({"windows_nb": 121}, sections, compression)
+        header, decoded = WireMessage.decode(message)
+        assert header == {"windows_nb": 121, "compression": compression}
+        assert decoded == sections
+
+        # cut in the header, in a section, and inflating past the limit
+        for truncated in [message[:2], message[:10], message[:-1]]:
+            try:
+                WireMessage.decode(truncated)
+                assert False, f"decoded a truncated {compression} message"
+            except ValueError:
+                pass
+        try:
+            WireMessage.decode(message, max_size=1000)
+            assert False, f"decoded an oversized {compression} message"
+        except ValueError:
+            pass
+
+
+def test_precomputed_encryption(encryptor: Encryptor):
+    image = torch.rand(28, 28)
+    expected, _ = ts.im2col_encoding(encryptor.context, image.tolist(), 7, 7, 2)
+    output = encryptor.decrypt(encryptor.encrypt_image(image, encryptor.encrypt_zero()))
+    assert abs(output - encryptor.decrypt(expected)).max() < 1e-3
+
+
+class OfflineInferenceClient(InferenceClient):
+    # no server: a prediction sums the image once released, the first idle
+    # step fails
+    def __init__(self, *args, **kwargs):
+        self.started, self.release = threading.Event(), threading.Event()
+        self.recovered = threading.Event()
+        self.idle_steps = 0
+        super().__init__(*args, **kwargs)
+
+    def infer(self, image):
+        self.started.set()
+        self.release.wait()
+        return image.sum()
+
+    def _precompute_step(self) -> bool:
+        self.idle_steps += 1
+        if self.idle_steps == 1:
+            raise RuntimeError("idle step failed")
+        self.recovered.set()
+        return False
+
+
+def test_inference_client(encryptor: Encryptor):
+    client = OfflineInferenceClient(encryptor=encryptor, idle_interval=0.01)
+    # the worker outlived the failure of its idle step
+    assert client.recovered.wait(timeout=5.0)
+
+    images = np.arange(3).reshape(3, 1, 1)
+    first = client.predict(images[0])
+    client.started.wait()
+    # replaced by the next prediction while the first one is in flight
+    second, third = client.predict(images[1]), client.predict(images[2])
+    client.release.set()
+    assert first.result() == 0 and third.result() == 2 and second.cancelled()
+    client.close()
+
+
 if __name__ == "__main__":
     encryptor = Encryptor()
     test_ckks_classifier(encryptor)
     print("CKKS Classifier Test ✅")
+    test_ckks_classifier_batch(encryptor)
+    print("CKKS Batched Classifier Test ✅")
+    test_ckks_classifier_merged(encryptor)
+    print("CKKS Merged Classifier Test ✅")
+    test_micro_batch_scheduler()
+    print("Micro Batch Scheduler Test ✅")
+    test_rotation_keys()
+    print("Rotation Keys Test ✅")
+    test_rotation_keys_forward(encryptor)
+    print("Rotation Keys Forward Test ✅")
     test_encoder_serializer(encryptor)
     print("Encoder Serializer Test ✅")
+    test_context_registry(encryptor)
+    print("Context Registry Test ✅")
+    test_spooled_context_registry()
+    print("Spooled Context Registry Test ✅")
+    test_wire_message()
+    print("Wire Message Test ✅")
+    test_precomputed_encryption(encryptor)
+    print("Precomputed Encryption Test ✅")
+    test_inference_client(encryptor)
+    print("Inference Client Test ✅")
@@ -0,0 +1,139 @@
+import json
+import struct
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class WireMessage:
+    """
+    Binary framing for contexts and ciphertexts:
+    [4-byte big-endian header length][JSON header][section bytes...]
+    The header lists the sections in order with their (compressed) sizes,
+    so nothing on the wire is base64-encoded.
+    """
+
+    MEDIA_TYPE = "application/octet-stream"
+    HEADER_LENGTH = struct.Struct(">I")
+    COMPRESSIONS = [None, "zlib", "zstd"]
+    # decompressed bytes a message may inflate to, a context with every
+    # default Galois key is ~210 MB
+    MAX_SIZE = 1 << 30
+
+    @classmethod
+    def compress(cls, data: bytes, compression: str | None) -> bytes:
+        if compression is None:
+            return data
+        if compression == "zlib":
+            return zlib.compress(data, 1)
+        if compression == "zstd":
+            cls._check_zstd()
+            return zstandard.ZstdCompressor(level=3).compress(data)
+        raise ValueError(f"Invalid compression! Allowed: {cls.COMPRESSIONS}")
+
+    @classmethod
+    def decompress(
+        cls, data: bytes, compression: str | None, max_size: int | None = None
+    ) -> bytes:
+        """
+        Raises a ValueError once the output exceeds `max_size` bytes, without
+        inflating more than that of an untrusted message.
+        """
+        max_size = cls.MAX_SIZE if max_size is None else max_size
+        if compression is None:
+            output = bytes(data[: max_size + 1])
+        elif compression == "zlib":
+            decompressor = zlib.decompressobj()
+            output = decompressor.decompress(data, max_size + 1)
+            if not decompressor.eof and len(output) <= max_size:
+                raise ValueError("Truncated zlib stream")
+        elif compression == "zstd":
+            cls._check_zstd()
+            try:
+                # frames without a declared size are inflated up to the limit
+                content_size = zstandard.frame_content_size(bytes(data[:18]))
+                if content_size > max_size:
+                    raise ValueError(
+                        f"Message exceeds {max_size} bytes once decompressed"
+                    )
+                output = zstandard.ZstdDecompressor().decompress(
+                    data, max_output_size=max_size + 1 if content_size < 0 else 0
+                )
+            except zstandard.ZstdError as e:
+                raise ValueError(f"Invalid zstd stream: {e}") from e
+        else:
+            raise ValueError(f"Invalid compression! Allowed: {cls.COMPRESSIONS}")
+
+        if len(output) > max_size:
+            raise ValueError(f"Message exceeds {max_size} bytes once decompressed")
+        return output
+
+    @classmethod
+    def _check_zstd(cls):
+        if zstandard is None:
+            raise ValueError("zstd compression requires the zstandard package")
+
+    @classmethod
+    def iter_encoded(
+        cls, header: dict, sections: dict[str, bytes], compression: str | None = None
+    ):
+        payloads = [cls.compress(data, compression) for data in sections.values()]
+        header = {
+            **header,
+            "compression": compression,
+            "sections": [
+                [name, len(payload)] for name, payload in zip(sections, payloads)
+            ],
+        }
+        header_bytes = json.dumps(header).encode("utf-8")
+
+        yield cls.HEADER_LENGTH.pack(len(header_bytes)) + header_bytes
+        yield from payloads
+
+    @classmethod
+    def encode(
+        cls, header: dict, sections: dict[str, bytes], compression: str | None = None
+    ) -> bytes:
+        return b"".join(cls.iter_encoded(header, sections, compression))
+
+    @classmethod
+    def decode(
+        cls, data: bytes, max_size: int | None = None
+    ) -> tuple[dict, dict[str, bytes]]:
+        """
+        Raises a ValueError for a truncated or malformed message, or one whose
+        sections add up to more than `max_size` bytes (MAX_SIZE by default).
+        """
+        max_size = cls.MAX_SIZE if max_size is None else max_size
+        data = memoryview(data)
+        offset = cls.HEADER_LENGTH.size
+        if len(data) < offset:
+            raise ValueError("Truncated message: missing header length")
+        (header_length,) = cls.HEADER_LENGTH.unpack_from(data)
+        if offset + header_length > len(data):
+            raise ValueError("Truncated message: header is incomplete")
+        header = json.loads(bytes(data[offset : offset + header_length]))
+        offset += header_length
+        if (
+            not isinstance(header, dict)
+            or not isinstance(header.get("sections"), list)
+            or header.get("compression") not in cls.COMPRESSIONS
+        ):
+            raise ValueError("Malformed header")
+
+        sections = {}
+        for section in header.pop("sections"):
+            name, size = section
+            if not isinstance(name, str) or not isinstance(size, int) or size < 0:
+                raise ValueError(f"Malformed section: {section}")
+            if offset + size > len(data):
+                raise ValueError(f"Truncated message: section {name} is incomplete")
+            sections[name] = cls.decompress(
+                data[offset : offset + size], header["compression"], max_size
+            )
+            max_size -= len(sections[name])
+            offset += size
+        return header, sections